@@ -0,0 +1,68 @@
+"""Time machine_learning_dynamic_job under the multiprocess executor against the number of processes
+
+Run from the week_1 directory:
+
+    python -m benchmarks.dynamic_chunks --rows 500000 --chunk-size 4194304
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from challenge.week_1_challenge import machine_learning_dynamic_job
+from dagster import execute_job, instance_for_test, reconstructable
+
+
+def write_stock_file(file_name: str, rows: int):
+    generator = random.Random(0)
+    start = date(2000, 1, 1)
+    with open(file_name, "w") as file:
+        for index in range(rows):
+            price = generator.uniform(50, 500)
+            day = (start + timedelta(days=index % 10000)).strftime("%Y/%m/%d")
+            volume = generator.randint(1, 10**7)
+            file.write(f'"{day}","{price:.4f}","{volume}.0000","{price:.4f}","{price + 1:.4f}","{price - 1:.4f}"\n')
+
+
+def seconds(file_name: str, chunk_size: int, processes: int) -> float:
+    run_config = {
+        "ops": {
+            "get_s3_data_op": {"config": {"s3_key": file_name, "chunk_size": chunk_size}},
+            "process_data_op": {"config": {"nlargest": 10}},
+        },
+        "execution": {"config": {"multiprocess": {"max_concurrent": processes}}},
+    }
+    with instance_for_test() as instance:
+        start = time.perf_counter()
+        result = execute_job(reconstructable(machine_learning_dynamic_job), instance=instance, run_config=run_config)
+        elapsed = time.perf_counter() - start
+    assert result.success
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--chunk-size", type=int, default=4 << 20)
+    parser.add_argument("--max-processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "stock.csv")
+        write_stock_file(file_name, args.rows)
+        size = os.path.getsize(file_name)
+        print(f"{args.rows:,} rows, {size / 2**20:.0f} MiB in {-(-size // args.chunk_size)} chunks")
+
+        baseline = seconds(file_name, size, 1)
+        print(f"{'single chunk':<14} {baseline:>8.1f}s")
+        processes = 1
+        while processes <= args.max_processes:
+            elapsed = seconds(file_name, args.chunk_size, processes)
+            print(f"{f'{processes} processes':<14} {elapsed:>8.1f}s {baseline / elapsed:>6.1f}x")
+            processes *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 import csv
+import os
 from datetime import datetime
-from heapq import nlargest
-from typing import Iterator, List
+from heapq import heappush, heapreplace
+from typing import Iterable, Iterator, List, Optional
 
 from dagster import (
     Any,
     DynamicOut,
     DynamicOutput,
+    Field,
     In,
+    Int,
     Nothing,
     OpExecutionContext,
     Out,
@@ -46,6 +49,7 @@ class Stock(BaseModel):
 class Aggregation(BaseModel):
     date: datetime
     high: float
+    volume: Optional[int] = None
 
 
 def csv_helper(file_name: str) -> Iterator[Stock]:
@@ -55,24 +59,146 @@ def csv_helper(file_name: str) -> Iterator[Stock]:
             yield Stock.from_list(row)
 
 
-@op
-def get_s3_data_op():
-    pass
+TOP_N_FIELDS = ("high", "volume")
+
+
+@usable_as_dagster_type(description="Line aligned byte range of a stock file")
+class StockChunk(BaseModel):
+    path: str
+    start: int
+    end: int
+
+
+@usable_as_dagster_type(description="Aggregations with the n greatest highs of part of the data")
+class TopAggregations(BaseModel):
+    n: int
+    aggregations: List[Aggregation]
+
+
+def top_n(records: Iterable, n: int, by: str = "high") -> List:
+    """The n records with the greatest value of the attribute by, greatest first
+
+    Keeps a min-heap of at most n records while streaming, so it runs in
+    O(len(records) log n) time and O(n) memory. Ties go to the earliest record.
+    """
+    if by not in TOP_N_FIELDS:
+        raise ValueError(f"Unknown field {by}, expected one of {TOP_N_FIELDS}")
+    heap = []
+    for index, record in enumerate(records):
+        item = (getattr(record, by), -index, record)
+        if len(heap) < n:
+            heappush(heap, item)
+        elif item[:2] > heap[0][:2]:
+            heapreplace(heap, item)
+    return [record for _, _, record in sorted(heap, key=lambda item: item[:2], reverse=True)]
+
+
+def split_file(file_name: str, chunk_size: int) -> Iterator[StockChunk]:
+    """Cut a file into ranges of about chunk_size bytes, each ending after a newline"""
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+    size = os.path.getsize(file_name)
+    with open(file_name, "rb") as file:
+        start = 0
+        while start < size:
+            end = start + chunk_size
+            if end < size:
+                # Reading from the byte before end keeps a range that already ends on a line break
+                file.seek(end - 1)
+                file.readline()
+                end = file.tell()
+            end = min(end, size)
+            yield StockChunk(path=file_name, start=start, end=end)
+            start = end
+
+
+def read_chunk(chunk: StockChunk) -> Iterator[Stock]:
+    with open(chunk.path, "rb") as file:
+        file.seek(chunk.start)
+        lines = file.read(chunk.end - chunk.start).decode("utf-8").splitlines()
+    for row in csv.reader(lines):
+        if row:
+            yield Stock.from_list(row)
+
+
+@op(
+    config_schema={
+        "s3_key": String,
+        "chunk_size": Field(
+            Int, default_value=1 << 20, description="Bytes of the file each mapped process_data_op reads"
+        ),
+    },
+    out={
+        "stocks": DynamicOut(dagster_type=StockChunk, is_required=False),
+        "empty_stocks": Out(dagster_type=Any, is_required=False),
+    },
+    description="Split a stock file into byte range chunks",
+)
+def get_s3_data_op(context: OpExecutionContext):
+    chunks = list(split_file(context.op_config["s3_key"], context.op_config["chunk_size"]))
+    if not chunks:
+        yield Output(None, "empty_stocks")
+        return
+    context.log.info(f"Split {context.op_config['s3_key']} into {len(chunks)} chunks")
+    for index, chunk in enumerate(chunks):
+        yield DynamicOutput(chunk, mapping_key=f"chunk_{index}", output_name="stocks")
+
+
+@op(
+    config_schema={"nlargest": Field(Int, default_value=1, description="How many of the greatest highs to keep")},
+    ins={"chunk": In(dagster_type=StockChunk)},
+    out=Out(dagster_type=TopAggregations),
+    description="Find the greatest highs in one chunk of a stock file",
+)
+def process_data_op(context: OpExecutionContext, chunk: StockChunk) -> TopAggregations:
+    n = context.op_config["nlargest"]
+    highest = top_n(read_chunk(chunk), n)
+    return TopAggregations(n=n, aggregations=[Aggregation(date=stock.date, high=stock.high) for stock in highest])
+
+
+@op(
+    ins={"partials": In(dagster_type=List[TopAggregations])},
+    out=Out(dagster_type=List[Aggregation]),
+    description="Merge the greatest highs found in each chunk",
+)
+def combine_data_op(context: OpExecutionContext, partials: List[TopAggregations]) -> List[Aggregation]:
+    # The top n of the whole file are among the top n of each chunk
+    n = max(partial.n for partial in partials)
+    aggregations = (aggregation for partial in partials for aggregation in partial.aggregations)
+    return top_n(aggregations, n)
 
 
-@op
-def process_data_op():
-    pass
+@op(
+    config_schema={
+        "s3_key": String,
+        "n": Field(Int, default_value=10, description="How many days to keep"),
+        "by": Field(String, default_value="high", description=f"Field to rank days by, one of {TOP_N_FIELDS}"),
+    },
+    out=Out(dagster_type=List[Aggregation]),
+    description="Stream a stock file into the top n days by high or volume",
+)
+def top_n_data_op(context: OpExecutionContext) -> List[Aggregation]:
+    stocks = csv_helper(context.op_config["s3_key"])
+    top = top_n(stocks, context.op_config["n"], by=context.op_config["by"])
+    return [Aggregation(date=stock.date, high=stock.high, volume=stock.volume) for stock in top]
 
 
-@op
-def put_redis_data_op():
-    pass
+@op(
+    ins={"aggregations": In(dagster_type=List[Aggregation])},
+    out=Out(Nothing),
+    description="Upload Aggregations to Redis",
+)
+def put_redis_data_op(context: OpExecutionContext, aggregations: List[Aggregation]):
+    context.log.info(f"Writing {len(aggregations)} aggregations to Redis")
 
 
-@op
-def put_s3_data_op():
-    pass
+@op(
+    ins={"aggregations": In(dagster_type=List[Aggregation])},
+    out=Out(Nothing),
+    description="Upload Aggregations to S3",
+)
+def put_s3_data_op(context: OpExecutionContext, aggregations: List[Aggregation]):
+    context.log.info(f"Writing {len(aggregations)} aggregations to S3")
 
 
 @op(
@@ -86,4 +212,15 @@ def empty_stock_notify_op(context: OpExecutionContext, empty_stocks: Any):
 
 @job
 def machine_learning_dynamic_job():
-    pass
+    stocks, empty_stocks = get_s3_data_op()
+    aggregations = combine_data_op(stocks.map(process_data_op).collect())
+    put_redis_data_op(aggregations)
+    put_s3_data_op(aggregations)
+    empty_stock_notify_op(empty_stocks)
+
+
+@job
+def machine_learning_top_n_job():
+    aggregations = top_n_data_op()
+    put_redis_data_op(aggregations)
+    put_s3_data_op(aggregations)
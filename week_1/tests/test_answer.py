@@ -4,6 +4,10 @@ import pytest
 from challenge.week_1_challenge import (
     empty_stock_notify_op,
     machine_learning_dynamic_job,
+    machine_learning_top_n_job,
+    read_chunk,
+    split_file,
+    top_n,
 )
 from dagster import build_op_context
 from project.week_1 import (
@@ -137,3 +141,56 @@ def test_job_challenge_empty(empty_file_path):
     assert result.success
     assert result.output_for_node("get_s3_data_op", "empty_stocks") is None
     assert result.output_for_node("empty_stock_notify_op") is None
+
+
+@pytest.mark.challenge
+def test_split_file(file_path):
+    chunks = list(split_file(file_path, 1000))
+    assert len(chunks) > 1
+    assert chunks[0].start == 0
+    assert all(previous.end == chunk.start for previous, chunk in zip(chunks, chunks[1:]))
+    with open(file_path) as csvfile:
+        assert sum(len(list(read_chunk(chunk))) for chunk in chunks) == len(csvfile.readlines())
+    with pytest.raises(ValueError):
+        list(split_file(file_path, 0))
+
+
+@pytest.mark.challenge
+def test_job_challenge_chunks(file_path):
+    results = [
+        machine_learning_dynamic_job.execute_in_process(
+            run_config={
+                "ops": {
+                    "get_s3_data_op": {"config": {"s3_key": file_path, "chunk_size": chunk_size}},
+                    "process_data_op": {"config": {"nlargest": 3}},
+                }
+            }
+        ).output_for_node("combine_data_op")
+        for chunk_size in (1000, 1 << 20)
+    ]
+    assert results[0] == results[1]
+    assert len(results[0]) == 3
+    assert results[0][0].high >= results[0][1].high >= results[0][2].high
+
+
+@pytest.mark.challenge
+def test_top_n(stocks):
+    assert top_n(stocks, 2) == [stocks[2], stocks[3]]
+    assert top_n(stocks, 2, by="volume") == stocks[:2]
+    assert top_n(stocks, 10) == [stocks[2], stocks[3], stocks[0], stocks[1]]
+    assert top_n([], 3) == []
+    with pytest.raises(ValueError):
+        top_n(stocks, 2, by="close")
+
+
+@pytest.mark.challenge
+def test_job_top_n(file_path):
+    result = machine_learning_top_n_job.execute_in_process(
+        run_config={"ops": {"top_n_data_op": {"config": {"s3_key": file_path, "n": 5, "by": "volume"}}}}
+    )
+    assert result.success
+    aggregations = result.output_for_node("top_n_data_op")
+    assert len(aggregations) == 5
+    assert [aggregation.volume for aggregation in aggregations] == sorted(
+        (aggregation.volume for aggregation in aggregations), reverse=True
+    )
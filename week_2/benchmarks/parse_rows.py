@@ -0,0 +1,54 @@
+"""Compare Stock.from_list with the bulk Stock.parse_rows path
+
+Run from the week_2 directory:
+
+    python -m benchmarks.parse_rows --rows 200000
+"""
+import argparse
+import csv
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from workspaces.types import Stock
+
+DATA_FILE = Path(__file__).parent.parent / "data" / "stock.csv"
+
+
+def load_rows(count: int) -> List[List[str]]:
+    with open(DATA_FILE) as csvfile:
+        sample = [row for row in csv.reader(csvfile) if row]
+    return [sample[index % len(sample)] for index in range(count)]
+
+
+def rows_per_second(parse: Callable[[List[List[str]]], List[Stock]], rows: List[List[str]], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(rows)
+        best = min(best, time.perf_counter() - start)
+    return len(rows) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = load_rows(args.rows)
+    results = {
+        "from_list": rows_per_second(lambda data: [Stock.from_list(row) for row in data], rows, args.repeat),
+        "parse_rows(validate=True)": rows_per_second(lambda data: Stock.parse_rows(data), rows, args.repeat),
+        "parse_rows(validate=False)": rows_per_second(
+            lambda data: Stock.parse_rows(data, validate=False), rows, args.repeat
+        ),
+    }
+
+    baseline = results["from_list"]
+    for name, rate in results.items():
+        print(f"{name:<28} {rate:>12,.0f} rows/sec {rate / baseline:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
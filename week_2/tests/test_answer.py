@@ -11,7 +11,7 @@ from workspaces.project.week_2 import (
     put_s3_data,
 )
 from workspaces.resources import mock_s3_resource
-from workspaces.types import Aggregation, Stock
+from workspaces.types import Aggregation, Stock, StockBatch
 
 
 @pytest.fixture
@@ -44,10 +44,31 @@ def test_stock_class_method(stock_list):
     assert isinstance(stock, Stock)
 
 
+def test_stock_parse_rows(stock_list):
+    stocks = Stock.parse_rows([stock_list, [], stock_list], validate=False)
+    assert stocks == [Stock.from_list(stock_list)] * 2
+    assert Stock.parse_rows([stock_list]) == stocks[:1]
+
+
 def test_aggregation(aggregation):
     assert isinstance(aggregation, Aggregation)
 
 
+def test_stock_batch(stocks, stock_list):
+    batch = StockBatch.from_stocks(stocks)
+    assert len(batch) == 4
+    assert batch[2] == stocks[2]
+    assert list(batch) == stocks
+    assert len(batch[1:3]) == 2
+
+    batch = StockBatch.from_rows([stock_list, [], stock_list])
+    assert len(batch) == 2
+    assert batch[0] == Stock.from_list(stock_list)
+
+    unpadded = ["2020/9/1", *stock_list[1:]]
+    assert StockBatch.from_rows([unpadded])[0] == Stock.from_list(unpadded) == Stock.from_list(stock_list)
+
+
 def test_get_s3_data(stock_list):
     s3_mock = MagicMock()
     s3_mock.get_data.return_value = [stock_list] * 10
@@ -61,6 +82,13 @@ def test_process_data(stocks):
         assert process_data(context, stocks) == Aggregation(date=datetime.datetime(2022, 1, 3, 0, 0), high=12.0)
 
 
+def test_process_data_stock_batch(stocks):
+    with build_op_context() as context:
+        assert process_data(context, StockBatch.from_stocks(stocks)) == Aggregation(
+            date=datetime.datetime(2022, 1, 3, 0, 0), high=12.0
+        )
+
+
 def test_put_redis_data(aggregation):
     redis_mock = MagicMock()
     with build_op_context(resources={"redis": redis_mock}) as context:
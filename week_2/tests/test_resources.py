@@ -1,6 +1,62 @@
+import datetime
+import gzip
+import io
+import json
+import os
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import redis
+import sqlalchemy
 import workspaces.config as con
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
 from dagster import build_init_resource_context
-from workspaces.resources import S3, Redis, redis_resource, s3_resource
+from workspaces.resources import (
+    S3,
+    Postgres,
+    Redis,
+    S3DiskCache,
+    get_s3_client,
+    object_source,
+    postgres_resource,
+    redis_resource,
+    s3_resource,
+)
+from workspaces.types import Aggregation, AggregationState, StockBatch
+
+
+def streaming_body(data: bytes) -> StreamingBody:
+    return StreamingBody(io.BytesIO(data), len(data))
+
+
+class RangedS3Stub:
+    """Stand-in for an S3 client that serves (ranged) GETs from memory"""
+
+    def __init__(self, data: bytes, etag: str = '"v1"', ignore_range: bool = False):
+        self.data = data
+        self.etag = etag
+        self.ignore_range = ignore_range
+        self.ranges = []
+        self.if_match = []
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None, IfMatch: str = None) -> dict:
+        if Range is None or self.ignore_range:
+            return {"Body": streaming_body(self.data), "ETag": self.etag}
+        if not self.data:
+            raise ClientError({"Error": {"Code": "InvalidRange"}}, "GetObject")
+        if IfMatch is not None and IfMatch != self.etag:
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "GetObject")
+        self.ranges.append(Range)
+        self.if_match.append(IfMatch)
+        start, end = (int(position) for position in Range[len("bytes=") :].split("-"))
+        part = self.data[start : end + 1]
+        return {
+            "Body": streaming_body(part),
+            "ContentRange": f"bytes {start}-{start + len(part) - 1}/{len(self.data)}",
+            "ETag": self.etag,
+        }
 
 
 def test_s3_resource():
@@ -8,6 +64,384 @@ def test_s3_resource():
     assert type(resource) is S3
 
 
+def test_s3_resource_shares_client():
+    first = s3_resource(build_init_resource_context(config=con.S3))
+    second = s3_resource(build_init_resource_context(config=con.S3))
+    assert first.client is second.client
+    assert first.client.meta.config.max_pool_connections == 10
+
+    other = get_s3_client(
+        access_key="test", secret_key="test", endpoint_url=con.S3["endpoint_url"], max_pool_connections=20
+    )
+    assert other is not first.client
+    assert other.meta.config.max_pool_connections == 20
+
+
 def test_redis_resource():
     resource = redis_resource(build_init_resource_context(config=con.REDIS))
     assert type(resource) is Redis
+
+
+def test_postgres_resource_shares_engine():
+    config = {"host": "localhost", "user": "postgres", "password": "postgres", "database": "postgres"}
+    first = postgres_resource(build_init_resource_context(config=config))
+    second = postgres_resource(build_init_resource_context(config=config))
+    other = postgres_resource(build_init_resource_context(config={**config, "pool_size": 2}))
+
+    assert first._engine is second._engine
+    assert other._engine is not first._engine
+    assert first._engine.pool.size() == 5
+    assert other._engine.pool.size() == 2
+
+
+def test_redis_resource_shares_pool():
+    first = redis_resource(build_init_resource_context(config=con.REDIS))
+    second = redis_resource(build_init_resource_context(config=con.REDIS))
+    pool = first.client.connection_pool
+    assert second.client.connection_pool is pool
+    assert pool.max_connections == 50
+    assert pool.connection_kwargs["health_check_interval"] == 30
+
+    other = Redis(host=con.REDIS["host"], port=con.REDIS["port"], max_connections=5)
+    assert other.client.connection_pool is not pool
+
+
+@patch("time.sleep")
+def test_redis_retries_transient_errors(sleep):
+    resource = Redis(host="localhost", port=6379, max_retries=3, retry_on=["ConnectionError"])
+    resource.client = MagicMock()
+    resource.client.pipeline.return_value.__enter__.return_value.execute.side_effect = [
+        redis.exceptions.ConnectionError(),
+        redis.exceptions.ConnectionError(),
+        [True],
+    ]
+    assert resource.put_many({"2022-01-01": "10.0"}) == 2
+    assert sleep.call_count == 2
+
+    resource.client.pipeline.return_value.__enter__.return_value.execute.side_effect = (
+        redis.exceptions.ConnectionError()
+    )
+    with pytest.raises(redis.exceptions.ConnectionError):
+        resource.put_many({"2022-01-01": "10.0"})
+
+    resource.client.pipeline.return_value.__enter__.return_value.execute.side_effect = ValueError()
+    with pytest.raises(ValueError):
+        resource.put_many({"2022-01-01": "10.0"})
+
+
+def test_redis_put_many():
+    resource = Redis(host="localhost", port=6379, chunk_size=2)
+    resource.client = MagicMock()
+    resource.put_many({f"2022-01-0{n}": str(n) for n in range(1, 6)})
+
+    resource.client.pipeline.assert_called_with(transaction=False)
+    pipe = resource.client.pipeline.return_value.__enter__.return_value
+    assert [call.args[0] for call in pipe.mset.call_args_list] == [
+        {"2022-01-01": "1", "2022-01-02": "2"},
+        {"2022-01-03": "3", "2022-01-04": "4"},
+        {"2022-01-05": "5"},
+    ]
+    pipe.execute.assert_called_once()
+
+
+def test_s3_get_data_streams_records():
+    data = '2020/09/01,10.0,10,10.0,10.0,10.0\n"2020/09/02","11.5",20,"x,y",é,10.0\n2020/09/03,1,2,3,4,5'.encode()
+    s3 = S3(bucket="dagster", access_key="test", secret_key="test", chunk_size=5)
+    s3.client = MagicMock()
+    s3.client.get_object.return_value = {"Body": streaming_body(data)}
+
+    assert list(s3.get_data("prefix/stock.csv")) == [
+        ["2020/09/01", "10.0", "10", "10.0", "10.0", "10.0"],
+        ["2020/09/02", "11.5", "20", "x,y", "é", "10.0"],
+        ["2020/09/03", "1", "2", "3", "4", "5"],
+    ]
+    s3.client.get_object.assert_called_with(Bucket="dagster", Key="prefix/stock.csv")
+
+
+def test_s3_get_data_ranged_parts():
+    rows = [[f"2020/09/{day:02}", "10.0", str(day), "10.0", f"{day}.5", "10.0"] for day in range(1, 31)]
+    data = "\n".join(",".join(row) for row in rows).encode()
+    s3 = S3(bucket="dagster", access_key="test", secret_key="test", part_size=64, max_concurrency=4)
+    s3.client = RangedS3Stub(data)
+
+    assert list(s3.get_data("prefix/stock.csv")) == rows
+    assert len(s3.client.ranges) == -(-len(data) // 64)
+    assert s3.client.if_match == [None] + ['"v1"'] * (len(s3.client.ranges) - 1)
+
+    s3.client = RangedS3Stub(b"")
+    assert list(s3.get_data("prefix/stock.csv")) == []
+
+    s3.client = RangedS3Stub(data, ignore_range=True)
+    assert list(s3.get_data("prefix/stock.csv")) == rows
+
+
+def test_s3_get_data_ranged_parts_overwritten():
+    data = b"2020/09/01,10.0,1,10.0,10.5,10.0\n" * 10
+    s3 = S3(bucket="dagster", access_key="test", secret_key="test", part_size=64, max_concurrency=2)
+    s3.client = RangedS3Stub(data)
+    records = s3.get_data("prefix/stock.csv")
+    next(records)
+    s3.client.etag = '"v2"'
+
+    with pytest.raises(RuntimeError, match="overwritten"):
+        list(records)
+
+
+def test_s3_get_many():
+    objects = {f"prefix/stock_{n}.csv": f"2020/09/0{n},10.0,{n},10.0,10.0,10.0\n".encode() for n in range(1, 6)}
+    s3 = S3(bucket="dagster", access_key="test", secret_key="test")
+    s3.client = MagicMock()
+    s3.client.get_object.side_effect = lambda Bucket, Key: {"Body": streaming_body(objects[Key]), "ETag": f'"{Key}"'}
+
+    etags = {}
+    results = dict(s3.get_many(objects, max_workers=3, etags=etags))
+    assert results == {
+        key: [[f"2020/09/0{n}", "10.0", str(n), "10.0", "10.0", "10.0"]] for n, key in enumerate(objects, start=1)
+    }
+    assert etags == {key: f'"{key}"' for key in objects}
+    assert object_source("prefix/stock_1.csv", '"abc"') == "prefix/stock_1.csv@abc"
+    assert object_source("prefix/stock_1.csv", None) == "prefix/stock_1.csv"
+
+
+def test_s3_get_data_gzip():
+    text = "".join(f"2020/09/{day:02},10.0,{day},10.0,10.0,10.0\n" for day in range(1, 21))
+    # Two concatenated gzip members, detected from the key suffix
+    data = gzip.compress(text[:100].encode()) + gzip.compress(text[100:].encode())
+    s3 = S3(bucket="dagster", access_key="test", secret_key="test", chunk_size=16)
+    s3.client = MagicMock()
+    s3.client.get_object.return_value = {"Body": streaming_body(data)}
+    assert len(list(s3.get_data("prefix/stock.csv.gz"))) == 20
+
+    # Or from the ContentEncoding header
+    s3.client.get_object.return_value = {
+        "Body": streaming_body(gzip.compress(text.encode())),
+        "ContentEncoding": "gzip",
+    }
+    assert len(list(s3.get_data("prefix/stock.csv"))) == 20
+
+
+def test_s3_get_data_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    text = "".join(f"2020/09/{day:02},10.0,{day},10.0,10.0,10.0\n" for day in range(1, 21))
+    s3 = S3(bucket="dagster", access_key="test", secret_key="test", chunk_size=16)
+    s3.client = MagicMock()
+    s3.client.get_object.return_value = {"Body": streaming_body(zstandard.ZstdCompressor().compress(text.encode()))}
+    assert len(list(s3.get_data("prefix/stock.csv.zst"))) == 20
+
+    # Two concatenated frames, as written by pzstd or chunked writers
+    compressor = zstandard.ZstdCompressor()
+    data = compressor.compress(text[:100].encode()) + compressor.compress(text[100:].encode())
+    s3.client.get_object.return_value = {"Body": streaming_body(data)}
+    assert len(list(s3.get_data("prefix/stock.csv.zst"))) == 20
+
+
+@pytest.mark.parametrize("key_name", ["prefix/stock.csv.gz", "prefix/stock.csv.zst"])
+def test_s3_get_data_truncated(key_name):
+    zstandard = pytest.importorskip("zstandard")
+    text = "".join(f"2020/09/{day:02},10.0,{day},10.0,10.0,10.0\n" for day in range(1, 21)).encode()
+    data = gzip.compress(text) if key_name.endswith(".gz") else zstandard.ZstdCompressor().compress(text)
+    s3 = S3(bucket="dagster", access_key="test", secret_key="test", chunk_size=16)
+    s3.client = MagicMock()
+    s3.client.get_object.return_value = {"Body": streaming_body(data[:-8])}
+    with pytest.raises(EOFError):
+        list(s3.get_data(key_name))
+
+
+def test_s3_put_data_gzip():
+    s3 = S3(bucket="dagster", access_key="test", secret_key="test", compression="gzip")
+    s3.client = MagicMock()
+    s3.put_data("aggregation.json", Aggregation(date=datetime.datetime(2022, 1, 1), high=10.0))
+
+    kwargs = s3.client.put_object.call_args.kwargs
+    assert kwargs["ContentEncoding"] == "gzip"
+    assert json.loads(gzip.decompress(kwargs["Body"])) == {"date": "2022-01-01 00:00:00", "high": 10.0}
+
+
+def test_s3_get_data_disk_cache(tmp_path):
+    objects = {"prefix/stock_1.csv": b"2020/09/01,10.0,1,10.0,10.0,10.0\n"}
+
+    def get_object(Bucket: str, Key: str, IfNoneMatch: str = None) -> dict:
+        etag = f'"{hash(objects[Key])}"'
+        if IfNoneMatch == etag:
+            raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject")
+        return {"Body": streaming_body(objects[Key]), "ETag": etag}
+
+    s3 = S3(bucket="dagster", access_key="test", secret_key="test", cache_dir=str(tmp_path), cache_max_bytes=40)
+    s3.client = MagicMock()
+    s3.client.get_object.side_effect = get_object
+
+    assert list(s3.get_data("prefix/stock_1.csv")) == [["2020/09/01", "10.0", "1", "10.0", "10.0", "10.0"]]
+    assert list(s3.get_data("prefix/stock_1.csv")) == [["2020/09/01", "10.0", "1", "10.0", "10.0", "10.0"]]
+    assert s3.client.get_object.call_args.kwargs["IfNoneMatch"] == get_object("", "prefix/stock_1.csv")["ETag"]
+
+    objects["prefix/stock_1.csv"] = b"2020/09/02,10.0,2,10.0,10.0,10.0\n"
+    assert list(s3.get_data("prefix/stock_1.csv")) == [["2020/09/02", "10.0", "2", "10.0", "10.0", "10.0"]]
+
+    # A second object pushes the cache past its size limit and evicts the older entry
+    objects["prefix/stock_2.csv"] = b"2020/09/03,10.0,3,10.0,10.0,10.0\n"
+    list(s3.get_data("prefix/stock_2.csv"))
+    assert len(list(tmp_path.glob("*.data"))) == 1
+    assert len(list(tmp_path.glob("*.json"))) == 1
+    assert s3.cache.lookup("dagster", "prefix/stock_1.csv") is None
+
+
+def test_s3_disk_cache_sweeps_stale_tmp_files(tmp_path):
+    cache = S3DiskCache(str(tmp_path), max_bytes=1024, tmp_max_age=60)
+    stale, fresh = tmp_path / "stale.tmp", tmp_path / "fresh.tmp"
+    stale.write_bytes(b"partial")
+    fresh.write_bytes(b"partial")
+    os.utime(stale, (time.time() - 120, time.time() - 120))
+
+    cache.evict()
+    assert not stale.exists()
+    assert fresh.exists()
+
+
+def test_redis_timeseries():
+    resource = Redis(host="localhost", port=6379, storage_mode="timeseries", series_key="stocks")
+    resource.client = MagicMock()
+    aggregations = [Aggregation(date=datetime.datetime(2022, 1, day), high=float(day)) for day in (1, 2)]
+    resource.put_series(aggregations)
+
+    pipe = resource.client.pipeline.return_value.__enter__.return_value
+    pipe.zadd.assert_called_with("stocks", {"2022-01-01 00:00:00": 1640995200, "2022-01-02 00:00:00": 1641081600})
+    fields = pipe.hset.call_args.kwargs["mapping"]
+
+    resource.client.zrangebyscore.return_value = [b"2022-01-02 00:00:00"]
+    resource.client.hmget.return_value = [fields["2022-01-02 00:00:00"]]
+    assert resource.get_range(datetime.datetime(2022, 1, 2), datetime.datetime(2022, 1, 31)) == aggregations[1:]
+    resource.client.zrangebyscore.assert_called_with("stocks", 1641081600, 1643587200)
+
+
+def test_redis_merge_state():
+    resource = Redis(host="localhost", port=6379, retry_backoff=0)
+    resource.client = MagicMock()
+    pipe = resource.client.pipeline.return_value.__enter__.return_value
+    stored = AggregationState.from_batch(StockBatch.from_rows([["2022/01/01", "10.0", "10", "10.0", "12.0", "9.0"]]))
+    stored.version = 3
+    pipe.get.return_value = stored.json()
+    pipe.sismember.return_value = False
+    pipe.execute.side_effect = [redis.WatchError(), None]
+    delta = AggregationState.from_batch(StockBatch.from_rows([["2022/01/01", "10.0", "10", "10.0", "11.0", "8.0"]]))
+
+    merged = resource.merge_state(delta, "prefix/stock_2.csv@abc")
+
+    assert merged.version == 4
+    assert merged.count == 2
+    assert merged.days["2022-01-01"].low == 8.0
+    assert merged.max_high == Aggregation(date=datetime.datetime(2022, 1, 1), high=12.0)
+    assert pipe.watch.call_count == 2
+    pipe.watch.assert_called_with("aggregation_state", "aggregation_state:sources")
+    pipe.set.assert_called_with("aggregation_state", merged.json())
+    pipe.sadd.assert_called_with("aggregation_state:sources", "prefix/stock_2.csv@abc")
+
+    pipe.reset_mock()
+    pipe.get.return_value = merged.json()
+    pipe.sismember.return_value = True
+    assert resource.merge_state(delta, "prefix/stock_2.csv@abc") == merged
+    assert not pipe.set.called
+
+    # Conflicting writers give up at the retry deadline instead of looping forever
+    pipe.sismember.return_value = False
+    pipe.execute.side_effect = redis.WatchError()
+    with pytest.raises(redis.WatchError):
+        resource.merge_state(delta, "prefix/stock_3.csv@def")
+    assert pipe.execute.call_count == resource.max_retries + 1
+
+
+def test_postgres_bulk_insert_copy():
+    copied = []
+    cursor = MagicMock()
+    cursor.__enter__.return_value.copy_expert.side_effect = lambda sql, stream: copied.append((sql, stream.read()))
+    database = Postgres(host="localhost", user="postgres", password="postgres", database="postgres")
+    database._engine = MagicMock()
+    database._engine.dialect.driver = "psycopg2"
+    database._engine.raw_connection.return_value.cursor.return_value = cursor
+
+    written = database.bulk_insert("analytics.dbt_table", ("column_1", "column_2"), [("A", "B,C")] * 3)
+
+    assert written == 3
+    assert copied == [("COPY analytics.dbt_table (column_1, column_2) FROM STDIN WITH (FORMAT csv)", 'A,"B,C"\r\n' * 3)]
+    database._engine.raw_connection.return_value.commit.assert_called_once()
+
+
+def test_postgres_bulk_insert_fallback():
+    database = Postgres(host="localhost", user="postgres", password="postgres", database="postgres")
+    database._engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    database.execute_query("CREATE TABLE fake_table (column_1 VARCHAR(100))")
+
+    written = database.bulk_insert("fake_table", ("column_1",), (("1",) for _ in range(25)), chunk_size=10)
+
+    assert written == 25
+    assert database.execute_query("SELECT COUNT(*) FROM fake_table").scalar() == 25
+
+
+def test_postgres_stream_query():
+    database = Postgres(host="localhost", user="postgres", password="postgres", database="postgres")
+    database._engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    database.execute_query("CREATE TABLE fake_table (column_1 INTEGER)")
+    database.bulk_insert("fake_table", ("column_1",), ((value,) for value in range(25)))
+
+    chunks = list(database.stream_query("SELECT column_1 FROM fake_table ORDER BY column_1", chunk_size=10))
+
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert [row[0] for chunk in chunks for row in chunk] == list(range(25))
+
+
+def test_postgres_upsert():
+    database = Postgres(host="localhost", user="postgres", password="postgres", database="postgres")
+    database._engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    database.execute_query("CREATE TABLE fake_table (id INTEGER PRIMARY KEY, updated VARCHAR(10), value VARCHAR(10))")
+    rows = [(1, "2022-07-01", "a"), (2, "2022-07-02", "b")]
+
+    assert database.upsert("fake_table", ("id", "updated", "value"), rows, key=("id",)) == 2
+    assert database.upsert("fake_table", ("id", "updated", "value"), [(2, "2022-07-03", "c")], key=("id",)) == 1
+    # The last row of a repeated key wins
+    assert database.upsert("fake_table", ("id", "value"), [(1, "d"), (1, "e")], key=("id",)) == 2
+
+    assert database.execute_query("SELECT * FROM fake_table ORDER BY id").fetchall() == [
+        (1, "2022-07-01", "e"),
+        (2, "2022-07-03", "c"),
+    ]
+
+
+def test_postgres_upsert_watermark():
+    database = Postgres(host="localhost", user="postgres", password="postgres", database="postgres")
+    database._engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    database.execute_query("CREATE TABLE fake_table (id INTEGER PRIMARY KEY, updated VARCHAR(10))")
+    columns = ("id", "updated")
+    upsert = dict(key=("id",), watermark_column="updated", partition_key="2022-07-01")
+
+    assert database.get_watermark("fake_table", "2022-07-01") is None
+    assert database.upsert("fake_table", columns, [(1, "2022-07-01"), (2, "2022-07-02")], **upsert) == 2
+    assert database.get_watermark("fake_table", "2022-07-01") == "2022-07-02"
+
+    assert (
+        database.upsert("fake_table", columns, [(1, "2022-07-01"), (2, "2022-07-02"), (3, "2022-07-03")], **upsert) == 1
+    )
+    assert database.get_watermark("fake_table", "2022-07-01") == "2022-07-03"
+    assert database.get_watermark("fake_table", "2022-07-02") is None
+    assert database.execute_query("SELECT COUNT(*) FROM fake_table").scalar() == 3
+
+
+def test_postgres_upsert_copy():
+    copied = []
+    database = Postgres(host="localhost", user="postgres", password="postgres", database="postgres")
+    database._engine = MagicMock()
+    database._engine.dialect.driver = "psycopg2"
+    connection = database._engine.begin.return_value.__enter__.return_value
+    cursor = connection.connection.cursor.return_value.__enter__.return_value
+    cursor.copy_expert.side_effect = lambda sql, stream: copied.append((sql, stream.read()))
+
+    written = database.upsert("analytics.dbt_table", ("id", "value"), [(1, "a"), (2, "b")], key=("id",))
+
+    assert written == 2
+    assert copied == [("COPY analytics_dbt_table_staging (id, value) FROM STDIN WITH (FORMAT csv)", "1,a\r\n2,b\r\n")]
+    assert [call.args[0] for call in connection.execute.call_args_list] == [
+        "CREATE TEMPORARY TABLE analytics_dbt_table_staging ON COMMIT DROP AS "
+        "SELECT id, value FROM analytics.dbt_table WITH NO DATA",
+        "ALTER TABLE analytics_dbt_table_staging ADD COLUMN staging_row BIGSERIAL",
+        "INSERT INTO analytics.dbt_table (id, value) "
+        "SELECT DISTINCT ON (id) id, value FROM analytics_dbt_table_staging "
+        "ORDER BY id, staging_row DESC ON CONFLICT (id) DO UPDATE SET value = EXCLUDED.value",
+    ]
@@ -0,0 +1,148 @@
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+from dagster import usable_as_dagster_type
+from workspaces.types import Aggregation, StockBatch
+
+PERIODS = ("daily", "weekly", "monthly")
+
+
+@usable_as_dagster_type(description="Metrics of stock data over one period")
+class PeriodAggregation(Aggregation):
+    """OHLC, volume and derived metrics for the period starting at date"""
+
+    open: float
+    low: float
+    close: float
+    volume: int
+    vwap: float
+    moving_average: Optional[float]
+    volatility: float
+
+
+@usable_as_dagster_type(description="Columnar batch of period metrics")
+class PeriodBatch:
+    """Period metrics held as one NumPy array per field, like StockBatch
+
+    Rows become PeriodAggregation records only when they are accessed.
+    """
+
+    fields = ("date", "open", "high", "low", "close", "volume", "vwap", "moving_average", "volatility")
+
+    def __init__(self, **columns: Sequence):
+        self.date = np.asarray(columns["date"], dtype="datetime64[s]")
+        self.volume = np.asarray(columns["volume"], dtype=np.int64)
+        for name in self.fields:
+            if name not in ("date", "volume"):
+                setattr(self, name, np.asarray(columns[name], dtype=np.float64))
+
+    @classmethod
+    def empty(cls) -> "PeriodBatch":
+        return cls(**{name: [] for name in cls.fields})
+
+    def row(self, index: int) -> PeriodAggregation:
+        moving_average = float(self.moving_average[index])
+        return PeriodAggregation.construct(
+            date=self.date[index].item(),
+            open=float(self.open[index]),
+            high=float(self.high[index]),
+            low=float(self.low[index]),
+            close=float(self.close[index]),
+            volume=int(self.volume[index]),
+            vwap=float(self.vwap[index]),
+            moving_average=None if np.isnan(moving_average) else moving_average,
+            volatility=float(self.volatility[index]),
+        )
+
+    def to_aggregations(self) -> List[PeriodAggregation]:
+        return list(self)
+
+    def __len__(self) -> int:
+        return len(self.date)
+
+    def __iter__(self) -> Iterator[PeriodAggregation]:
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def __getitem__(self, index: int) -> PeriodAggregation:
+        return self.row(index)
+
+
+def _period_keys(dates: np.ndarray, period: str) -> np.ndarray:
+    """Start of the period each date falls in, weeks starting on Monday"""
+    days = dates.astype("datetime64[D]")
+    if period == "daily":
+        return days
+    if period == "weekly":
+        # datetime64 weeks start on Thursday, the weekday of the epoch
+        ordinal = days.astype(np.int64)
+        return (ordinal - (ordinal + 3) % 7).astype("datetime64[D]")
+    if period == "monthly":
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    raise ValueError(f"Unknown period {period}, expected one of {PERIODS}")
+
+
+def aggregate(batch: StockBatch, period: str = "daily", window: int = 5) -> PeriodBatch:
+    """Aggregate a batch into one row per period, oldest period first
+
+    Every metric is computed with grouped NumPy reductions over the columns:
+    open and close are the first open and last close of the period, vwap weighs
+    the typical price (high + low + close) / 3 by volume, moving_average is the
+    mean close of the last window periods (NaN until there are enough) and
+    volatility is the standard deviation of the log returns between closes
+    within the period.
+    """
+    if window < 1:
+        raise ValueError(f"window must be at least 1, got {window}")
+    keys = _period_keys(batch.date, period)
+    if not len(batch):
+        return PeriodBatch.empty()
+
+    columns = (keys, batch.open, batch.high, batch.low, batch.close, batch.volume)
+    if np.any(batch.date[1:] < batch.date[:-1]):
+        order = np.argsort(batch.date, kind="stable")
+        columns = tuple(column[order] for column in columns)
+    keys, open, high, low, close, volume = columns
+    period_dates = keys.astype("datetime64[s]")
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    counts = ends - starts + 1
+
+    period_high = np.maximum.reduceat(high, starts)
+    period_low = np.minimum.reduceat(low, starts)
+    period_close = close[ends]
+    period_volume = np.add.reduceat(volume, starts)
+
+    typical = (high + low + close) / 3
+    weighted = np.add.reduceat(typical * volume, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vwap = np.where(period_volume > 0, weighted / period_volume, np.add.reduceat(typical, starts) / counts)
+
+    returns = np.zeros(len(close))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns[1:] = np.log(close[1:] / close[:-1])
+    returns[starts] = 0.0
+    number_of_returns = counts - 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(number_of_returns > 0, np.add.reduceat(returns, starts) / number_of_returns, 0.0)
+    deviations = returns - np.repeat(mean, counts)
+    deviations[starts] = 0.0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = np.where(number_of_returns > 0, np.add.reduceat(deviations**2, starts) / number_of_returns, 0.0)
+    volatility = np.sqrt(variance)
+
+    cumulative = np.r_[0.0, np.cumsum(period_close)]
+    moving_average = np.full(len(starts), np.nan)
+    moving_average[window - 1 :] = (cumulative[window:] - cumulative[:-window]) / window
+
+    return PeriodBatch(
+        date=period_dates[starts],
+        open=open[starts],
+        high=period_high,
+        low=period_low,
+        close=period_close,
+        volume=period_volume,
+        vwap=vwap,
+        moving_average=moving_average,
+        volatility=volatility,
+    )
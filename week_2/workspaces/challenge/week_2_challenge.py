@@ -39,14 +39,12 @@ def create_dbt_table(context: OpExecutionContext):
     tags={"kind": "postgres"},
 )
 def insert_dbt_data(context: OpExecutionContext, table_name: String):
-    sql = f"INSERT INTO {table_name} (column_1, column_2, column_3) VALUES ('A', 'B', 'C');"
-
     number_of_rows = randint(1, 100)
-    for _ in range(number_of_rows):
-        context.resources.database.execute_query(sql)
-        context.log.info("Inserted a row")
+    context.resources.database.bulk_insert(
+        table_name, ("column_1", "column_2", "column_3"), [("A", "B", "C")] * number_of_rows
+    )
 
-    context.log.info("Batch inserted")
+    context.log.info(f"Batch inserted {number_of_rows} rows")
 
 
 @graph
@@ -24,14 +24,10 @@ def create_table(context: OpExecutionContext):
     tags={"kind": "postgres"},
 )
 def insert_into_table(context: OpExecutionContext, table_name):
-    sql = f"INSERT INTO {table_name} (column_1) VALUES (1);"
-
     number_of_rows = randint(1, 10)
-    for _ in range(number_of_rows):
-        context.resources.database.execute_query(sql)
-        context.log.info("Inserted a row")
+    context.resources.database.bulk_insert(table_name, ("column_1",), [("1",)] * number_of_rows)
 
-    context.log.info("Batch inserted")
+    context.log.info(f"Batch inserted {number_of_rows} rows")
 
 
 @graph
@@ -3,6 +3,8 @@ from typing import List
 
 import dagstermill as dm
 from dagster import (
+    Bool,
+    Field,
     In,
     OpExecutionContext,
     Out,
@@ -17,18 +19,22 @@ from workspaces.types import Aggregation, Stock
 
 
 @op(
-    config_schema={"s3_key": String},
+    config_schema={
+        "s3_key": Field(String),
+        "trusted": Field(
+            Bool,
+            default_value=False,
+            description="Skip pydantic validation of the records, only for sources known to be well formed",
+        ),
+    },
     out={"stocks": Out(dagster_type=List[Stock])},
     required_resource_keys={"s3"},
     tags={"kind": "s3"},
     description="Get a list of stocks from an S3 file",
 )
 def get_s3_data(context: OpExecutionContext):
-    output = list()
-    for row in context.resources.s3.get_data(key_name=context.op_config["s3_key"]):
-        stock = Stock.from_list(row)
-        output.append(stock)
-    return output
+    rows = context.resources.s3.get_data(key_name=context.op_config["s3_key"])
+    return Stock.parse_rows(rows, validate=not context.op_config["trusted"])
 
 
 process_jupyter_notebook = dm.define_dagstermill_op(
@@ -13,32 +13,71 @@ from dagster import (
 )
 from workspaces.config import REDIS, S3, S3_FILE
 from workspaces.resources import mock_s3_resource, redis_resource, s3_resource
-from workspaces.types import Aggregation, Stock
+from workspaces.types import Aggregation, Stock, StockBatch, StockRecords
 
 
-@op
-def get_s3_data():
-    pass
-
-
-@op
-def process_data():
-    pass
-
-
-@op
-def put_redis_data():
-    pass
+@op(
+    config_schema={"s3_key": String},
+    out={"stocks": Out(dagster_type=StockBatch)},
+    required_resource_keys={"s3"},
+    tags={"kind": "s3"},
+    description="Get a batch of stocks from an S3 file",
+)
+def get_s3_data(context: OpExecutionContext) -> StockBatch:
+    return StockBatch.from_rows(context.resources.s3.get_data(key_name=context.op_config["s3_key"]))
 
 
-@op
-def put_s3_data():
-    pass
+@op(
+    ins={"stocks": In(dagster_type=StockRecords)},
+    out={"aggregation": Out(dagster_type=Aggregation)},
+    description="Given a list of stocks return the Aggregation with the greatest high",
+)
+def process_data(context: OpExecutionContext, stocks) -> Aggregation:
+    if isinstance(stocks, StockBatch):
+        return stocks.max_high()
+    highest = max(stocks, key=lambda stock: stock.high)
+    return Aggregation(date=highest.date, high=highest.high)
+
+
+@op(
+    ins={"aggregation": In(dagster_type=Aggregation)},
+    out=Out(Nothing),
+    required_resource_keys={"redis"},
+    tags={"kind": "redis"},
+    description="Upload an Aggregation to Redis",
+)
+def put_redis_data(context: OpExecutionContext, aggregation: Aggregation):
+    redis = context.resources.redis
+    if redis.storage_mode == "timeseries":
+        retries = redis.put_series([aggregation])
+    else:
+        retries = redis.put_data(
+            name=str(aggregation.date),
+            value=str(aggregation.high),
+        )
+    context.add_output_metadata({"redis_retries": int(retries)})
+
+
+@op(
+    ins={"aggregation": In(dagster_type=Aggregation)},
+    out=Out(Nothing),
+    required_resource_keys={"s3"},
+    tags={"kind": "s3"},
+    description="Upload an Aggregation to S3 file",
+)
+def put_s3_data(context: OpExecutionContext, aggregation: Aggregation):
+    s3_key = f"/aggregations/{datetime.today().strftime('%Y_%m_%d')}.csv"
+    context.resources.s3.put_data(
+        key_name=s3_key,
+        data=aggregation,
+    )
 
 
 @graph
 def machine_learning_graph():
-    pass
+    aggregation = process_data(get_s3_data())
+    put_redis_data(aggregation)
+    put_s3_data(aggregation)
 
 
 local = {
@@ -55,8 +94,18 @@ docker = {
 
 machine_learning_job_local = machine_learning_graph.to_job(
     name="machine_learning_job_local",
+    config=local,
+    resource_defs={
+        "s3": mock_s3_resource,
+        "redis": ResourceDefinition.mock_resource(),
+    },
 )
 
 machine_learning_job_docker = machine_learning_graph.to_job(
     name="machine_learning_job_docker",
+    config=docker,
+    resource_defs={
+        "s3": s3_resource,
+        "redis": redis_resource,
+    },
 )
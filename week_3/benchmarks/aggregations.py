@@ -0,0 +1,110 @@
+"""Compare workspaces.aggregations.aggregate with the same metrics computed in Python loops
+
+Run from the week_3 directory:
+
+    python -m benchmarks.aggregations --rows 200000 --period weekly
+"""
+import argparse
+import math
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Callable, List
+
+import numpy as np
+from workspaces.aggregations import PERIODS, PeriodAggregation, aggregate
+from workspaces.types import Stock, StockBatch
+
+
+def synthetic_batch(rows: int) -> StockBatch:
+    """Random walk prices, several records a day"""
+    generator = np.random.default_rng(0)
+    close = 100 * np.exp(np.cumsum(generator.normal(0, 0.01, rows)))
+    spread = np.abs(generator.normal(0, 0.5, rows))
+    return StockBatch(
+        date=np.datetime64("2000-01-03", "s") + np.arange(rows) * np.timedelta64(4, "h"),
+        close=close,
+        volume=generator.integers(1, 10000, rows),
+        open=close + generator.normal(0, 0.2, rows),
+        high=close + spread,
+        low=close - spread,
+    )
+
+
+def period_start(stock: Stock, period: str):
+    day = stock.date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "weekly":
+        return day - timedelta(days=day.weekday())
+    if period == "monthly":
+        return day.replace(day=1)
+    return day
+
+
+def aggregate_loops(stocks: List[Stock], period: str, window: int) -> List[PeriodAggregation]:
+    groups = defaultdict(list)
+    for stock in sorted(stocks, key=lambda stock: stock.date):
+        groups[period_start(stock, period)].append(stock)
+
+    results, closes = [], []
+    for start, group in sorted(groups.items()):
+        volume = sum(stock.volume for stock in group)
+        typical = [(stock.high + stock.low + stock.close) / 3 for stock in group]
+        if volume:
+            vwap = sum(price * stock.volume for price, stock in zip(typical, group)) / volume
+        else:
+            vwap = sum(typical) / len(typical)
+        returns = [math.log(current.close / previous.close) for previous, current in zip(group, group[1:])]
+        mean = sum(returns) / len(returns) if returns else 0.0
+        volatility = math.sqrt(sum((value - mean) ** 2 for value in returns) / len(returns)) if returns else 0.0
+        closes.append(group[-1].close)
+        results.append(
+            PeriodAggregation.construct(
+                date=start,
+                open=group[0].open,
+                high=max(stock.high for stock in group),
+                low=min(stock.low for stock in group),
+                close=group[-1].close,
+                volume=volume,
+                vwap=vwap,
+                moving_average=sum(closes[-window:]) / window if len(closes) >= window else None,
+                volatility=volatility,
+            )
+        )
+    return results
+
+
+def seconds(run: Callable[[], List[PeriodAggregation]], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--period", choices=PERIODS, default="daily")
+    parser.add_argument("--window", type=int, default=5)
+    args = parser.parse_args()
+
+    batch = synthetic_batch(args.rows)
+    stocks = batch.to_stocks()
+    vectorized = aggregate(batch, args.period, args.window).to_aggregations()
+    looped = aggregate_loops(stocks, args.period, args.window)
+    assert len(vectorized) == len(looped)
+    for fast, slow in zip(vectorized, looped):
+        assert fast.date == slow.date and math.isclose(fast.vwap, slow.vwap) and fast.volume == slow.volume
+        assert math.isclose(fast.volatility, slow.volatility, rel_tol=1e-6, abs_tol=1e-12)
+
+    loops = seconds(lambda: aggregate_loops(stocks, args.period, args.window), args.repeat)
+    numpy = seconds(lambda: aggregate(batch, args.period, args.window), args.repeat)
+    print(f"{len(vectorized)} {args.period} periods from {args.rows:,} rows")
+    print(f"{'python loops':<14} {args.rows / loops:>14,.0f} rows/sec")
+    print(f"{'aggregate':<14} {args.rows / numpy:>14,.0f} rows/sec {loops / numpy:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
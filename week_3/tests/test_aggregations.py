@@ -0,0 +1,44 @@
+import datetime
+import math
+
+import pytest
+from workspaces.aggregations import PeriodAggregation, aggregate
+from workspaces.types import StockBatch
+
+
+@pytest.fixture
+def batch():
+    # date, close, volume, open, high, low; 2022-01-03 is a Monday
+    return StockBatch.from_rows(
+        [
+            ["2022/01/04", "11.0", "20", "10.5", "12.0", "10.0"],
+            ["2022/01/03", "10.0", "10", "9.0", "10.5", "8.5"],
+            ["2022/01/10", "12.0", "30", "11.5", "12.5", "11.0"],
+            ["2022/02/01", "13.0", "0", "12.0", "14.0", "12.0"],
+        ]
+    )
+
+
+def test_aggregate_weekly(batch):
+    periods = aggregate(batch, period="weekly", window=2)
+    assert len(periods) == 3
+    first = periods[0]
+    assert isinstance(first, PeriodAggregation)
+    assert first.date == datetime.datetime(2022, 1, 3)
+    assert (first.open, first.high, first.low, first.close, first.volume) == (9.0, 12.0, 8.5, 11.0, 30)
+    assert first.vwap == pytest.approx(((10.5 + 8.5 + 10.0) / 3 * 10 + 11.0 * 20) / 30)
+    assert first.moving_average is None
+    assert first.volatility == 0.0
+    assert periods[1].moving_average == pytest.approx((11.0 + 12.0) / 2)
+    assert periods[2].vwap == pytest.approx(13.0)
+
+
+def test_aggregate_periods(batch):
+    assert [period.date.day for period in aggregate(batch, period="daily")] == [3, 4, 10, 1]
+    monthly = aggregate(batch, period="monthly", window=1).to_aggregations()
+    assert [period.date for period in monthly] == [datetime.datetime(2022, 1, 1), datetime.datetime(2022, 2, 1)]
+    assert monthly[0].moving_average == monthly[0].close == 12.0
+    assert monthly[0].volatility == pytest.approx(abs(math.log(11.0 / 10.0) - math.log(12.0 / 11.0)) / 2)
+    assert len(aggregate(StockBatch.empty())) == 0
+    with pytest.raises(ValueError):
+        aggregate(batch, period="hourly")
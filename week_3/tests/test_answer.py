@@ -1,19 +1,39 @@
 import datetime
+import json
 from unittest.mock import MagicMock, patch
 
 import pytest
+import sqlalchemy
 from dagster import (
+    Failure,
     ResourceDefinition,
     RetryPolicy,
     RunRequest,
     SensorEvaluationContext,
     SkipReason,
+    build_input_context,
     build_op_context,
+    build_output_context,
+    build_sensor_context,
+)
+from workspaces.challenge.week_3_challenge import (
+    COLUMNS,
+    PostgresIOManager,
+    insert_data,
+    table_count,
 )
 from workspaces.config import REDIS, S3
-from workspaces.project.sensors import get_s3_keys
+from workspaces.content.etl import create_table
+from workspaces.project.sensors import (
+    batch_keys,
+    get_new_s3_objects,
+    get_s3_keys,
+    object_cursor,
+    objects_after,
+)
 from workspaces.project.week_3 import (
     docker_config,
+    get_and_process_data,
     get_s3_data,
     machine_learning_graph,
     machine_learning_job_docker,
@@ -24,9 +44,10 @@ from workspaces.project.week_3 import (
     process_data,
     put_redis_data,
     put_s3_data,
+    update_aggregation_state,
 )
-from workspaces.resources import mock_s3_resource
-from workspaces.types import Aggregation, Stock
+from workspaces.resources import Postgres, mock_s3_resource
+from workspaces.types import Aggregation, AggregationState, Stock, StockBatch
 
 
 @pytest.fixture
@@ -100,10 +121,31 @@ def test_stock_class_method(stock_list):
     assert isinstance(stock, Stock)
 
 
+def test_stock_parse_rows(stock_list):
+    stocks = Stock.parse_rows([stock_list, [], stock_list], validate=False)
+    assert stocks == [Stock.from_list(stock_list)] * 2
+    assert Stock.parse_rows([stock_list]) == stocks[:1]
+
+
 def test_aggregation(aggregation):
     assert isinstance(aggregation, Aggregation)
 
 
+def test_stock_batch(stocks, stock_list):
+    batch = StockBatch.from_stocks(stocks)
+    assert len(batch) == 4
+    assert batch[2] == stocks[2]
+    assert list(batch) == stocks
+    assert len(batch[1:3]) == 2
+
+    batch = StockBatch.from_rows([stock_list, [], stock_list])
+    assert len(batch) == 2
+    assert batch[0] == Stock.from_list(stock_list)
+
+    unpadded = ["2020/9/1", *stock_list[1:]]
+    assert StockBatch.from_rows([unpadded])[0] == Stock.from_list(unpadded) == Stock.from_list(stock_list)
+
+
 def test_get_s3_data(stock_list):
     s3_mock = MagicMock()
     s3_mock.get_data.return_value = [stock_list] * 10
@@ -112,11 +154,101 @@ def test_get_s3_data(stock_list):
         assert s3_mock.get_data.called
 
 
+def test_get_s3_data_keys(stock_list):
+    s3_mock = MagicMock()
+    s3_mock.get_many.return_value = [("data/stock_1.csv", [stock_list] * 2), ("data/stock_2.csv", [stock_list] * 3)]
+    keys = ["data/stock_1.csv", "data/stock_2.csv"]
+    with build_op_context(op_config={"s3_keys": keys}, resources={"s3": s3_mock}) as context:
+        batch = get_s3_data(context)
+        assert len(batch) == 5
+        assert batch.sources == [("data/stock_1.csv", 2), ("data/stock_2.csv", 3)]
+        s3_mock.get_many.assert_called_with(keys, etags={})
+
+
+def test_get_s3_data_etag(stock_list):
+    s3_mock = MagicMock()
+
+    def get_data(key_name, etags):
+        etags[key_name] = '"abc"'
+        return [stock_list] * 2
+
+    s3_mock.get_data.side_effect = get_data
+    with build_op_context(op_config={"s3_key": "data/stock.csv"}, resources={"s3": s3_mock}) as context:
+        assert get_s3_data(context).sources == [("data/stock.csv@abc", 2)]
+
+
+def test_get_and_process_data():
+    files = {
+        "data/stock_1.csv": [
+            ["2022/01/01", "10.0", "10", "10.0", "11.0", "10.0"],
+            [],
+            ["2022/01/02", "10.0", "10", "10.0", "14.0", "10.0"],
+        ],
+        "data/stock_2.csv": [
+            ["2022/01/03", "10.0", "10", "10.0", "13.0", "10.0"],
+            ["2022/01/04", "10.0", "10", "10.0", "14.0", "10.0"],
+        ],
+    }
+    s3_mock = MagicMock()
+    s3_mock.get_data.side_effect = lambda key_name: iter(files[key_name])
+    with patch.object(StockBatch, "chunk_size", 1):
+        with build_op_context(op_config={"s3_keys": list(files)}, resources={"s3": s3_mock}) as context:
+            assert get_and_process_data(context) == Aggregation(date=datetime.datetime(2022, 1, 2, 0, 0), high=14.0)
+
+    s3_mock.get_data.side_effect = lambda key_name: iter([])
+    with build_op_context(op_config={"s3_key": "data/empty.csv"}, resources={"s3": s3_mock}) as context:
+        with pytest.raises(Failure):
+            get_and_process_data(context)
+
+
+def test_aggregation_state(stocks):
+    first = AggregationState.from_batch(StockBatch.from_stocks(stocks[:2]))
+    second = AggregationState.from_batch(StockBatch.from_stocks(stocks[2:]))
+    merged = first.merge(second)
+
+    assert merged == second.merge(first)
+    assert merged.count == 4
+    assert merged.max_high == Aggregation(date=datetime.datetime(2022, 1, 3, 0, 0), high=12.0)
+    assert sum(day.count for day in merged.days.values()) == 4
+
+
+def test_update_aggregation_state(stocks):
+    redis_mock = MagicMock()
+    redis_mock.merge_state.return_value = AggregationState(version=1)
+    with build_op_context(resources={"redis": redis_mock}, op_config={"source": "prefix/stock_1.csv"}) as context:
+        update_aggregation_state(context, StockBatch.from_stocks(stocks))
+    delta, source = redis_mock.merge_state.call_args.args
+    assert delta.count == 4
+    assert source == "prefix/stock_1.csv"
+
+
+def test_update_aggregation_state_per_file(stocks):
+    redis_mock = MagicMock()
+    redis_mock.merge_state.return_value = AggregationState(version=1)
+    batch = StockBatch.concat(
+        [
+            StockBatch.from_stocks(stocks[:1]).with_source("prefix/stock_1.csv@a"),
+            StockBatch.from_stocks(stocks[1:]).with_source("prefix/stock_2.csv@b"),
+        ]
+    )
+    with build_op_context(resources={"redis": redis_mock}) as context:
+        update_aggregation_state(context, batch)
+    calls = [(call.args[0].count, call.args[1]) for call in redis_mock.merge_state.call_args_list]
+    assert calls == [(1, "prefix/stock_1.csv@a"), (3, "prefix/stock_2.csv@b")]
+
+
 def test_process_data(stocks):
     with build_op_context() as context:
         assert process_data(context, stocks) == Aggregation(date=datetime.datetime(2022, 1, 3, 0, 0), high=12.0)
 
 
+def test_process_data_stock_batch(stocks):
+    with build_op_context() as context:
+        assert process_data(context, StockBatch.from_stocks(stocks)) == Aggregation(
+            date=datetime.datetime(2022, 1, 3, 0, 0), high=12.0
+        )
+
+
 def test_put_redis_data(aggregation):
     redis_mock = MagicMock()
     with build_op_context(resources={"redis": redis_mock}) as context:
@@ -139,7 +271,7 @@ def test_machine_learning_job():
 
 
 def test_machine_learning_job_docker():
-    assert machine_learning_job_docker._solid_retry_policy == RetryPolicy(max_retries=10, delay=1)
+    assert machine_learning_job_docker._solid_retry_policy == RetryPolicy(max_retries=1, delay=1)
 
 
 def test_machine_learning_schedule_local():
@@ -152,12 +284,12 @@ def test_machine_learning_schedule_docker():
     assert machine_learning_schedule_docker.cron_schedule == "0 * * * *"
 
 
-@patch("boto3.client")
+@patch("workspaces.project.sensors.get_s3_client")
 def test_get_s3_keys(mock, boto3_return):
     mock.return_value.list_objects_v2.side_effect = boto3_return
     result = get_s3_keys(bucket="bucket", prefix="prefix")
 
-    mock.assert_called_with(service_name="s3")
+    mock.assert_called_with(access_key=None, secret_key=None, endpoint_url=None)
     mock.return_value.list_objects_v2.assert_called_with(
         Bucket="bucket",
         Delimiter="",
@@ -168,14 +300,101 @@ def test_get_s3_keys(mock, boto3_return):
     assert result == ["key_1", "key_2"]
 
 
-@patch("boto3.client")
+@patch("workspaces.project.sensors.get_s3_client")
+def test_get_s3_keys_start_after(mock, boto3_return):
+    mock.return_value.list_objects_v2.side_effect = boto3_return
+    result = get_s3_keys(bucket="bucket", prefix="prefix", start_after="key_0")
+
+    mock.return_value.list_objects_v2.assert_called_with(
+        Bucket="bucket",
+        Delimiter="",
+        MaxKeys=1000,
+        Prefix="prefix",
+        StartAfter="key_0",
+    )
+    assert result == ["key_1", "key_2"]
+
+
+@patch("workspaces.project.sensors.get_s3_client")
+def test_machine_learning_sensor_docker_cursor(mock, boto3_return):
+    mock.return_value.list_objects_v2.side_effect = boto3_return
+    context = build_sensor_context(cursor=json.dumps(["2014, 12, 31", "key_0"]))
+    assert [request.run_key for request in machine_learning_sensor_docker(context)] == ["key_1..key_2"]
+    assert mock.return_value.list_objects_v2.call_args.kwargs["StartAfter"] == "key_0"
+    assert json.loads(context.cursor) == ["2015, 1, 2", "key_2"]
+
+    # A bare key cursor from an older sensor still resumes the listing after it
+    mock.return_value.list_objects_v2.side_effect = boto3_return
+    list(machine_learning_sensor_docker(build_sensor_context(cursor="key_0")))
+    assert mock.return_value.list_objects_v2.call_args.kwargs["StartAfter"] == "key_0"
+
+
+@patch("workspaces.project.week_3.SENSOR_LISTING", "last_modified")
+@patch("workspaces.project.sensors.get_s3_client")
+def test_machine_learning_sensor_docker_last_modified(mock, boto3_return):
+    mock.return_value.list_objects_v2.side_effect = boto3_return
+    context = build_sensor_context(cursor=json.dumps(["2015, 1, 1", "key_1"]))
+    assert [request.run_key for request in machine_learning_sensor_docker(context)] == ["key_2"]
+    assert mock.return_value.list_objects_v2.call_args.kwargs["StartAfter"] == ""
+    assert json.loads(context.cursor) == ["2015, 1, 2", "key_2"]
+
+
+def test_objects_after():
+    objects = [
+        {"Key": "prefix/stock_9.csv", "LastModified": datetime.datetime(2015, 1, 1)},
+        {"Key": "prefix/stock_10.csv", "LastModified": datetime.datetime(2015, 1, 2)},
+        {"Key": "prefix/stock_11.csv", "LastModified": datetime.datetime(2015, 1, 3)},
+    ]
+    assert objects_after(objects, None) == objects
+    # stock_10 and stock_11 sort before stock_9 but were uploaded after it
+    assert objects_after(objects, object_cursor(objects[0])) == objects[1:]
+    assert objects_after(objects, object_cursor(objects[2])) == []
+    assert objects_after(objects, "prefix/stock_10.csv") == objects[2:]
+    assert objects_after(objects, "prefix/stock_1.csv") == objects
+
+
+def test_get_new_s3_objects_listing():
+    with pytest.raises(ValueError):
+        get_new_s3_objects(bucket="bucket", cursor=None, listing="newest")
+
+
+def test_batch_keys():
+    objects = [{"Key": f"key_{n}", "Size": size} for n, size in enumerate([10, 10, 10, 50, 10], start=1)]
+    assert batch_keys(objects, max_keys_per_run=1) == [[f"key_{n}"] for n in range(1, 6)]
+    assert batch_keys(objects, max_keys_per_run=2) == [["key_1", "key_2"], ["key_3", "key_4"], ["key_5"]]
+    assert batch_keys(objects, max_keys_per_run=10, max_bytes_per_run=30) == [
+        ["key_1", "key_2", "key_3"],
+        ["key_4"],
+        ["key_5"],
+    ]
+
+
+@patch("workspaces.project.sensors.get_s3_client")
+def test_machine_learning_sensor_docker_batch(mock, resource_config, boto3_return):
+    mock.return_value.list_objects_v2.side_effect = boto3_return
+    result = machine_learning_sensor_docker(SensorEvaluationContext(None, None, None, None, None))
+    assert list(result) == [
+        RunRequest(
+            run_key="key_1..key_2",
+            run_config={
+                **resource_config,
+                "ops": {"get_s3_data": {"config": {"s3_keys": ["key_1", "key_2"]}}},
+            },
+            tags={},
+            job_name=None,
+        )
+    ]
+
+
+@patch("workspaces.project.sensors.get_s3_client")
 def test_machine_learning_sensor_docker_none(mock, boto3_empty_return):
     mock.return_value.list_objects_v2.side_effect = boto3_empty_return
     result = machine_learning_sensor_docker(SensorEvaluationContext(None, None, None, None, None))
     assert next(result) == SkipReason(skip_message="No new s3 files found in bucket.")
 
 
-@patch("boto3.client")
+@patch("workspaces.project.week_3.SENSOR_MAX_KEYS_PER_RUN", 1)
+@patch("workspaces.project.sensors.get_s3_client")
 def test_machine_learning_sensor_docker_keys(mock, resource_config, boto3_return):
     mock.return_value.list_objects_v2.side_effect = boto3_return
     result = machine_learning_sensor_docker(SensorEvaluationContext(None, None, None, None, None))
@@ -206,3 +425,57 @@ def test_docker_config(resource_config):
         **resource_config,
         "ops": {"get_s3_data": {"config": {"s3_key": "prefix/stock_1.csv"}}},
     }
+
+
+def test_postgres_io_manager():
+    database = Postgres(host="localhost", user="postgres", password="postgres", database="postgres")
+    database._engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    database.execute_query(
+        "CREATE TABLE dbt_table (column_1 VARCHAR(100), column_2 VARCHAR(100), column_3 VARCHAR(100))"
+    )
+    manager = PostgresIOManager(database, schema_name="main", table_name="dbt_table", chunk_size=4)
+    output_context = build_output_context(metadata={"columns": COLUMNS})
+
+    rows = insert_data(build_op_context())
+    manager.handle_output(output_context, rows)
+    chunks = manager.load_input(build_input_context(upstream_output=output_context))
+
+    number_of_rows = table_count(build_op_context(), chunks)
+    assert number_of_rows == database.execute_query("SELECT COUNT(*) FROM dbt_table").scalar()
+    assert number_of_rows > 0
+    assert list(manager.load_input(build_input_context(upstream_output=output_context)))[0][0] == ("A", "B", "C")
+
+
+def test_create_table_partition():
+    database = MagicMock()
+    context = build_op_context(
+        op_config={"table_name": "fake_table", "process_date": "2022-07-31"}, resources={"database": database}
+    )
+    outputs = {output.output_name: output.value for output in create_table(context)}
+
+    assert outputs == {"table_name": "fake_table_20220731", "process_date": "2022-07-31"}
+    queries = [call.args[0] for call in database.execute_query.call_args_list]
+    assert "PARTITION BY RANGE (process_date)" in queries[0]
+    assert queries[1] == (
+        "CREATE TABLE IF NOT EXISTS fake_table_20220731 PARTITION OF fake_table "
+        "FOR VALUES FROM ('2022-07-31') TO ('2022-08-01');"
+    )
+
+
+def test_postgres_io_manager_upsert():
+    database = Postgres(host="localhost", user="postgres", password="postgres", database="postgres")
+    database._engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    database.execute_query("CREATE TABLE dbt_table (column_1 VARCHAR(100) PRIMARY KEY, column_2 VARCHAR(100))")
+    manager = PostgresIOManager(database, schema_name="main", table_name="dbt_table", write_mode="upsert")
+    metadata = {"columns": ["column_1", "column_2"], "key": ["column_1"]}
+
+    manager.handle_output(build_output_context(metadata=metadata), [("A", "B"), ("C", "D")])
+    manager.handle_output(build_output_context(metadata=metadata), [("A", "E")])
+
+    assert database.execute_query("SELECT * FROM dbt_table ORDER BY column_1").fetchall() == [("A", "E"), ("C", "D")]
+    with pytest.raises(Failure, match="'key'"):
+        manager.handle_output(build_output_context(metadata={"columns": COLUMNS}), [("A", "B", "C")])
+    with pytest.raises(Failure, match="column_3"):
+        manager.handle_output(build_output_context(metadata={**metadata, "key": ["column_3"]}), [("A", "B")])
+    with pytest.raises(ValueError):
+        PostgresIOManager(database, schema_name="main", table_name="dbt_table", write_mode="merge")
@@ -1,11 +1,13 @@
-import json
 from random import randint
-from typing import Dict, List
+from typing import Iterable, Iterator, List, Sequence
 
 from dagster import (
+    Failure,
+    Field,
     In,
     InitResourceContext,
     InputContext,
+    Int,
     IOManager,
     Nothing,
     OpExecutionContext,
@@ -16,25 +18,97 @@ from dagster import (
     io_manager,
     op,
 )
-from sqlalchemy import column, table
 from workspaces.config import ANALYTICS_TABLE, POSTGRES
-from workspaces.resources import postgres_resource
+from workspaces.resources import POSTGRES_WRITE_MODES, postgres_resource
 
-
-class PostgresIOManager(IOManager):
-    def __init__(self):
-        pass
-
-    def handle_output(self):
-        pass
-
-    def load_input(self):
-        pass
+COLUMNS = ["column_1", "column_2", "column_3"]
 
 
-@io_manager(required_resource_keys={"database"})
+class PostgresIOManager(IOManager):
+    """Stores op outputs as rows of a Postgres table
+
+    Outputs are iterables of row tuples, with the column names given in the
+    output metadata under "columns". They are bulk loaded with COPY, and inputs
+    come back as a lazy iterator of row chunks read from a server-side cursor.
+
+    In upsert mode rows are merged on the "key" columns from the output metadata
+    instead, so retries and re-runs do not duplicate them. An optional
+    "watermark_column" limits each partition's re-runs to the rows past its
+    high-water mark.
+    """
+
+    def __init__(
+        self, database, schema_name: str, table_name: str, chunk_size: int = 10000, write_mode: str = "append"
+    ):
+        if write_mode not in POSTGRES_WRITE_MODES:
+            raise ValueError(f"Unknown write mode {write_mode}, expected one of {POSTGRES_WRITE_MODES}")
+        self.database = database
+        self.schema_name = schema_name
+        self.table_name = table_name
+        self.chunk_size = chunk_size
+        self.write_mode = write_mode
+
+    @property
+    def qualified_name(self) -> str:
+        return f"{self.schema_name}.{self.table_name}"
+
+    def _output_metadata(self, context: OutputContext, name: str):
+        if name not in context.metadata:
+            raise Failure(
+                description=(
+                    f"Writing to {self.qualified_name} in {self.write_mode} mode needs {name!r} "
+                    f"in the output metadata, got {sorted(context.metadata)}"
+                )
+            )
+        return context.metadata[name]
+
+    def handle_output(self, context: OutputContext, obj: Iterable[Sequence]):
+        columns = self._output_metadata(context, "columns")
+        if self.write_mode == "upsert":
+            key = self._output_metadata(context, "key")
+            missing = [column for column in key if column not in columns]
+            if missing:
+                raise Failure(description=f"Upsert key columns {missing} are not among the output columns {columns}")
+            number_of_rows = self.database.upsert(
+                self.qualified_name,
+                columns,
+                obj,
+                key=key,
+                chunk_size=self.chunk_size,
+                watermark_column=context.metadata.get("watermark_column"),
+                partition_key=context.partition_key if context.has_partition_key else "",
+            )
+        else:
+            number_of_rows = self.database.bulk_insert(self.qualified_name, columns, obj, chunk_size=self.chunk_size)
+        context.log.info(f"Copied {number_of_rows} rows into {self.qualified_name}")
+        context.add_output_metadata({"table_name": self.qualified_name, "number_of_rows": number_of_rows})
+
+    def load_input(self, context: InputContext) -> Iterator[List[tuple]]:
+        columns = ", ".join(context.upstream_output.metadata["columns"])
+        return self.database.stream_query(f"SELECT {columns} FROM {self.qualified_name}", chunk_size=self.chunk_size)
+
+
+@io_manager(
+    config_schema={
+        "schema_name": Field(String),
+        "table_name": Field(String),
+        "chunk_size": Field(Int, default_value=10000, description="Rows buffered per COPY write or cursor fetch"),
+        "write_mode": Field(
+            String,
+            default_value="append",
+            description="append to bulk load outputs or upsert to merge them on the output metadata key",
+        ),
+    },
+    required_resource_keys={"database"},
+)
 def postgres_io_manager(init_context: InitResourceContext):
-    pass
+    return PostgresIOManager(
+        database=init_context.resources.database,
+        schema_name=init_context.resource_config["schema_name"],
+        table_name=init_context.resource_config["table_name"],
+        chunk_size=init_context.resource_config["chunk_size"],
+        write_mode=init_context.resource_config["write_mode"],
+    )
 
 
 @op(
@@ -53,25 +127,36 @@ def create_table(context: OpExecutionContext):
     return table_name
 
 
-@op
-def insert_data():
-    pass
+@op(
+    ins={"table_name": In(dagster_type=Nothing)},
+    out=Out(io_manager_key="postgres_io", metadata={"columns": COLUMNS}),
+    tags={"kind": "postgres"},
+)
+def insert_data(context: OpExecutionContext):
+    number_of_rows = randint(1, 100)
+    context.log.info(f"Generating {number_of_rows} rows")
+    return [("A", "B", "C")] * number_of_rows
 
 
-@op
-def table_count():
-    pass
+@op(
+    out=Out(Int),
+    tags={"kind": "postgres"},
+)
+def table_count(context: OpExecutionContext, rows):
+    number_of_rows = sum(len(chunk) for chunk in rows)
+    context.log.info(f"Table has {number_of_rows} rows")
+    return number_of_rows
 
 
 @graph
 def dbt_graph():
-    pass
+    table_count(insert_data(create_table()))
 
 
 docker = {
     "resources": {
         "database": {"config": POSTGRES},
-        "postgres_io": {"config": {"schema_name": "analytics", "table_name": "table"}},
+        "postgres_io": {"config": {"schema_name": "analytics", "table_name": "dbt_table"}},
     },
     "ops": {"create_table": {"config": {"table_name": ANALYTICS_TABLE}}},
 }
@@ -79,4 +164,9 @@ docker = {
 
 dbt_job_docker = dbt_graph.to_job(
     name="dbt_job_docker",
+    config=docker,
+    resource_defs={
+        "database": postgres_resource,
+        "postgres_io": postgres_io_manager,
+    },
 )
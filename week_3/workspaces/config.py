@@ -1,3 +1,5 @@
+import os
+
 DBT_PROJECT_PATH = "/opt/dagster/dagster_home/dbt_test_project/."
 
 POSTGRES = {
@@ -29,3 +31,12 @@ REDIS = {
 
 S3_FILE = "prefix/stock.csv"
 ANALYTICS_TABLE = "analytics.dbt_table"
+
+# How the sensor finds new S3 files, see workspaces.project.sensors.get_new_s3_objects. "start_after"
+# only reads the keys after the last one seen and needs keys written in sort order (zero-padded or
+# timestamped names). "last_modified" lists the whole prefix on every tick and finds any new file.
+SENSOR_LISTING = os.environ.get("SENSOR_LISTING", "start_after")
+
+# Upper bounds on the new S3 files the sensor groups into a single run, 0 disables the byte limit
+SENSOR_MAX_KEYS_PER_RUN = int(os.environ.get("SENSOR_MAX_KEYS_PER_RUN", 100))
+SENSOR_MAX_BYTES_PER_RUN = int(os.environ.get("SENSOR_MAX_BYTES_PER_RUN", 512 * 1024 * 1024))
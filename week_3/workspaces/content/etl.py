@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from random import randint
 
 from dagster import (
@@ -6,6 +6,7 @@ from dagster import (
     In,
     OpExecutionContext,
     Out,
+    Output,
     ResourceDefinition,
     String,
     build_schedule_from_partitioned_job,
@@ -18,33 +19,52 @@ from workspaces.config import POSTGRES
 from workspaces.resources import postgres_resource
 
 
+def partition_name(table_name: str, process_date: date) -> str:
+    return f"{table_name}_{process_date:%Y%m%d}"
+
+
 @op(
     config_schema={"table_name": String, "process_date": String},
-    out={"table_name": Out(dagster_type=String)},
+    out={"table_name": Out(dagster_type=String), "process_date": Out(dagster_type=String)},
     required_resource_keys={"database"},
     tags={"kind": "postgres"},
 )
 def create_table(context: OpExecutionContext):
+    """Create the table range partitioned by day, plus the partition for process_date
+
+    Each day lands in its own child table, so backfilled days write in parallel,
+    a day can be dropped with DROP TABLE and single day queries are pruned to one
+    partition. Outputs the child table the day's rows go to.
+    """
     table_name = context.op_config["table_name"]
-    sql = f"CREATE TABLE IF NOT EXISTS {table_name} (column_1 VARCHAR(100));"
+    process_date = datetime.strptime(context.op_config["process_date"], "%Y-%m-%d").date()
+    partition = partition_name(table_name, process_date)
+    sql = (
+        f"CREATE TABLE IF NOT EXISTS {table_name} (process_date DATE NOT NULL, column_1 VARCHAR(100)) "
+        "PARTITION BY RANGE (process_date);"
+    )
     context.resources.database.execute_query(sql)
-    return table_name
+    sql = (
+        f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table_name} "
+        f"FOR VALUES FROM ('{process_date}') TO ('{process_date + timedelta(days=1)}');"
+    )
+    context.resources.database.execute_query(sql)
+    yield Output(partition, "table_name")
+    yield Output(process_date.isoformat(), "process_date")
 
 
 @op(
-    ins={"table_name": In(dagster_type=String)},
+    ins={"table_name": In(dagster_type=String), "process_date": In(dagster_type=String)},
     required_resource_keys={"database"},
     tags={"kind": "postgres"},
 )
-def insert_into_table(context: OpExecutionContext, table_name: String):
-    sql = f"INSERT INTO {table_name} (column_1) VALUES (1);"
-
+def insert_into_table(context: OpExecutionContext, table_name: String, process_date: String):
     number_of_rows = randint(1, 10)
-    for _ in range(number_of_rows):
-        context.resources.database.execute_query(sql)
-        context.log.info("Inserted a row")
+    context.resources.database.bulk_insert(
+        table_name, ("process_date", "column_1"), [(process_date, "1")] * number_of_rows
+    )
 
-    context.log.info("Batch inserted")
+    context.log.info(f"Batch inserted {number_of_rows} rows")
 
     # New this week
     context.log_event(
@@ -58,8 +78,8 @@ def insert_into_table(context: OpExecutionContext, table_name: String):
 
 @graph
 def etl():
-    table = create_table()
-    insert_into_table(table)
+    table_name, process_date = create_table()
+    insert_into_table(table_name, process_date)
 
 
 local = {"ops": {"create_table": {"config": {"table_name": "fake_table", "process_date": "2020-07-01"}}}}
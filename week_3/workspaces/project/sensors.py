@@ -1,15 +1,27 @@
-import boto3
+import json
+from datetime import datetime
+from typing import List, Optional
 
+from workspaces.resources import get_s3_client
 
-def get_s3_keys(bucket: str, prefix: str = "", endpoint_url: str = None, since_key: str = None, max_keys: int = 1000):
-    """Get S3 keys"""
-    config = {"service_name": "s3"}
-    if endpoint_url:
-        config["endpoint_url"] = endpoint_url
 
-    client = boto3.client(**config)
+def get_s3_objects(
+    bucket: str,
+    prefix: str = "",
+    endpoint_url: str = None,
+    max_keys: int = 1000,
+    start_after: str = "",
+    access_key: str = None,
+    secret_key: str = None,
+) -> List[dict]:
+    """List the objects under a prefix that sort after start_after
 
-    cursor = ""
+    The client comes from the same process-wide cache as the S3 resource, so
+    sensor ticks reuse its connections.
+    """
+    client = get_s3_client(access_key=access_key, secret_key=secret_key, endpoint_url=endpoint_url)
+
+    cursor = start_after
     contents = []
 
     while True:
@@ -26,6 +38,136 @@ def get_s3_keys(bucket: str, prefix: str = "", endpoint_url: str = None, since_k
 
         cursor = response["Contents"][-1]["Key"]
 
+    return contents
+
+
+def _position(obj: dict) -> list:
+    modified = obj["LastModified"]
+    if isinstance(modified, datetime):
+        modified = modified.isoformat(timespec="microseconds")
+    return [str(modified), obj["Key"]]
+
+
+def object_cursor(obj: dict) -> str:
+    """Sensor cursor pointing at an object, the JSON [LastModified, key] pair"""
+    return json.dumps(_position(obj))
+
+
+def _parse_cursor(cursor: Optional[str]) -> Optional[list]:
+    try:
+        position = json.loads(cursor) if cursor else None
+    except ValueError:
+        return None
+    return position if isinstance(position, list) else None
+
+
+def cursor_key(cursor: Optional[str]) -> str:
+    """The key a sensor cursor points at, to resume a listing after it"""
+    position = _parse_cursor(cursor)
+    return position[1] if position else cursor or ""
+
+
+def objects_after(objects: List[dict], cursor: Optional[str]) -> List[dict]:
+    """Objects that come after the cursor in (LastModified, key) order, oldest first
+
+    Unlike a StartAfter listing this finds every new object, whatever its key
+    sorts as. A bare key cursor from an older sensor resumes after that object.
+    """
+    ordered = sorted(objects, key=_position)
+    position = _parse_cursor(cursor)
+    if position is None and cursor:
+        position = next((_position(obj) for obj in ordered if obj["Key"] == cursor), None)
+    if position is None:
+        return ordered
+    return [obj for obj in ordered if _position(obj) > position]
+
+
+SENSOR_LISTINGS = ("start_after", "last_modified")
+
+
+def get_new_s3_objects(
+    bucket: str,
+    cursor: Optional[str],
+    prefix: str = "",
+    listing: str = "start_after",
+    endpoint_url: str = None,
+    access_key: str = None,
+    secret_key: str = None,
+) -> List[dict]:
+    """List the objects added since a sensor cursor written by object_cursor
+
+    "start_after" resumes the listing after the cursor's key, so a tick only
+    reads the new keys, in key order. It relies on new objects getting keys
+    that sort after the old ones (zero-padded or timestamped names): any other
+    key is never seen. "last_modified" lists the whole prefix on every tick and
+    keeps the objects modified after the cursor, oldest first. It finds every
+    new object, but its cost grows with the size of the prefix.
+    """
+    if listing not in SENSOR_LISTINGS:
+        raise ValueError(f"Unknown sensor listing {listing}, expected one of {SENSOR_LISTINGS}")
+    start_after = cursor_key(cursor) if listing == "start_after" else ""
+    objects = get_s3_objects(
+        bucket=bucket,
+        prefix=prefix,
+        endpoint_url=endpoint_url,
+        start_after=start_after,
+        access_key=access_key,
+        secret_key=secret_key,
+    )
+    return objects if listing == "start_after" else objects_after(objects, cursor)
+
+
+def batch_keys(objects: List[dict], max_keys_per_run: int, max_bytes_per_run: int = 0) -> List[List[str]]:
+    """Group listed objects into batches of keys, keeping their order
+
+    A batch holds at most max_keys_per_run keys and, when max_bytes_per_run is
+    set, at most that many bytes. An object larger than the byte limit gets a
+    batch of its own.
+    """
+    batches = []
+    batch, batch_bytes = [], 0
+    for obj in objects:
+        size = obj.get("Size", 0)
+        if batch and (len(batch) == max_keys_per_run or (max_bytes_per_run and batch_bytes + size > max_bytes_per_run)):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(obj["Key"])
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def get_s3_keys(
+    bucket: str,
+    prefix: str = "",
+    endpoint_url: str = None,
+    since_key: str = None,
+    max_keys: int = 1000,
+    start_after: str = None,
+    access_key: str = None,
+    secret_key: str = None,
+):
+    """Get S3 keys
+
+    With start_after the listing resumes after that key and only the keys that
+    sort after it are read, in the lexicographic order S3 lists them. This makes
+    the cost proportional to the number of new keys, but only finds new objects
+    whose keys sort after the old ones (e.g. zero-padded or timestamped names).
+    """
+    contents = get_s3_objects(
+        bucket=bucket,
+        prefix=prefix,
+        endpoint_url=endpoint_url,
+        max_keys=max_keys,
+        start_after=start_after or "",
+        access_key=access_key,
+        secret_key=secret_key,
+    )
+
+    if start_after is not None:
+        return [obj["Key"] for obj in contents]
+
     sorted_keys = [obj["Key"] for obj in sorted(contents, key=lambda x: x["LastModified"])]
 
     if not since_key or since_key not in sorted_keys:
@@ -2,6 +2,8 @@ from datetime import datetime
 from typing import List
 
 from dagster import (
+    Failure,
+    Field,
     In,
     Nothing,
     OpExecutionContext,
@@ -12,41 +14,185 @@ from dagster import (
     ScheduleDefinition,
     SensorEvaluationContext,
     SkipReason,
+    String,
     graph,
     op,
     schedule,
     sensor,
     static_partitioned_config,
 )
-from workspaces.config import REDIS, S3
-from workspaces.project.sensors import get_s3_keys
-from workspaces.resources import mock_s3_resource, redis_resource, s3_resource
-from workspaces.types import Aggregation, Stock
+from workspaces.config import (
+    REDIS,
+    S3,
+    SENSOR_LISTING,
+    SENSOR_MAX_BYTES_PER_RUN,
+    SENSOR_MAX_KEYS_PER_RUN,
+)
+from workspaces.project.sensors import batch_keys, get_new_s3_objects, object_cursor
+from workspaces.resources import (
+    mock_s3_resource,
+    object_source,
+    redis_resource,
+    s3_resource,
+)
+from workspaces.types import (
+    Aggregation,
+    AggregationState,
+    Stock,
+    StockBatch,
+    StockRecords,
+)
+
 
+@op(
+    config_schema={
+        "s3_key": Field(String, is_required=False),
+        "s3_keys": Field([String], is_required=False, description="Several files fetched concurrently"),
+    },
+    out={"stocks": Out(dagster_type=StockBatch)},
+    required_resource_keys={"s3"},
+    tags={"kind": "s3"},
+    description="Get a batch of stocks from one or more S3 files",
+)
+def get_s3_data(context: OpExecutionContext) -> StockBatch:
+    # Each file's rows are tagged with its key and ETag, so update_aggregation_state merges every file once
+    etags = {}
+    if "s3_keys" in context.op_config:
+        keys = context.op_config["s3_keys"]
+        batches = [
+            StockBatch.from_rows(records).with_source(object_source(key, etags.get(key)))
+            for key, records in context.resources.s3.get_many(keys, etags=etags)
+        ]
+        context.log.info(f"Loaded {len(keys)} files")
+        return StockBatch.concat(batches) if batches else StockBatch.empty()
+    if "s3_key" in context.op_config:
+        key = context.op_config["s3_key"]
+        batch = StockBatch.from_rows(context.resources.s3.get_data(key_name=key, etags=etags))
+        return batch.with_source(object_source(key, etags.get(key)))
+    raise Failure(description="get_s3_data needs either s3_key or s3_keys in its config")
 
-@op
-def get_s3_data():
-    pass
 
+@op(
+    ins={"stocks": In(dagster_type=StockRecords)},
+    out={"aggregation": Out(dagster_type=Aggregation)},
+    description="Given a list of stocks return the Aggregation with the greatest high",
+)
+def process_data(context: OpExecutionContext, stocks) -> Aggregation:
+    if isinstance(stocks, StockBatch):
+        return stocks.max_high()
+    highest = max(stocks, key=lambda stock: stock.high)
+    return Aggregation(date=highest.date, high=highest.high)
+
+
+@op(
+    config_schema={
+        "s3_key": Field(String, is_required=False),
+        "s3_keys": Field([String], is_required=False, description="Several files streamed one after another"),
+    },
+    out={"aggregation": Out(dagster_type=Aggregation)},
+    required_resource_keys={"s3"},
+    tags={"kind": "s3"},
+    description="Stream stocks from S3 files into the Aggregation with the greatest high",
+)
+def get_and_process_data(context: OpExecutionContext) -> Aggregation:
+    # Fuses get_s3_data and process_data: only one chunk of records and the running max are held
+    keys = context.op_config.get("s3_keys") or ([context.op_config["s3_key"]] if "s3_key" in context.op_config else [])
+    if not keys:
+        raise Failure(description="get_and_process_data needs either s3_key or s3_keys in its config")
+
+    highest = None
+    number_of_records = 0
+    for key in keys:
+        for batch in StockBatch.iter_chunks(context.resources.s3.get_data(key_name=key)):
+            number_of_records += len(batch)
+            candidate = batch.max_high()
+            if highest is None or candidate.high > highest.high:
+                highest = candidate
+    if highest is None:
+        raise Failure(description=f"No stock records found in {keys}")
+    context.log.info(f"Aggregated {number_of_records} records from {len(keys)} files")
+    return highest
+
+
+@op(
+    ins={"aggregation": In(dagster_type=Aggregation)},
+    out=Out(Nothing),
+    required_resource_keys={"redis"},
+    tags={"kind": "redis"},
+    description="Upload an Aggregation to Redis",
+)
+def put_redis_data(context: OpExecutionContext, aggregation: Aggregation):
+    redis = context.resources.redis
+    if redis.storage_mode == "timeseries":
+        retries = redis.put_series([aggregation])
+    else:
+        retries = redis.put_data(
+            name=str(aggregation.date),
+            value=str(aggregation.high),
+        )
+    context.add_output_metadata({"redis_retries": int(retries)})
 
-@op
-def process_data():
-    pass
 
+@op(
+    config_schema={
+        "source": Field(
+            String,
+            is_required=False,
+            description=(
+                "Name of the data merged, defaults to each file's key and ETag, "
+                "then for stocks from no known file the run key, the partition or the run id"
+            ),
+        )
+    },
+    ins={"stocks": In(dagster_type=StockRecords)},
+    out=Out(Nothing),
+    required_resource_keys={"redis"},
+    tags={"kind": "redis"},
+    description="Merge the stocks into the aggregation state kept in Redis",
+)
+def update_aggregation_state(context: OpExecutionContext, stocks):
+    batch = stocks if isinstance(stocks, StockBatch) else StockBatch.from_stocks(stocks)
+    if "source" in context.op_config:
+        parts = [(context.op_config["source"], batch)]
+    else:
+        fallback = context.get_tag("dagster/run_key") or context.get_tag("dagster/partition") or context.run_id
+        parts = list(batch.split_sources()) or [(fallback, batch)]
 
-@op
-def put_redis_data():
-    pass
+    for source, rows in parts:
+        state = context.resources.redis.merge_state(AggregationState.from_batch(rows), source)
+        context.log.info(f"Merged {source} into aggregation state version {state.version}")
+    context.add_output_metadata({"state_version": int(state.version), "state_count": int(state.count)})
 
 
-@op
-def put_s3_data():
-    pass
+@op(
+    ins={"aggregation": In(dagster_type=Aggregation)},
+    out=Out(Nothing),
+    required_resource_keys={"s3"},
+    tags={"kind": "s3"},
+    description="Upload an Aggregation to S3 file",
+)
+def put_s3_data(context: OpExecutionContext, aggregation: Aggregation):
+    s3_key = f"/aggregations/{datetime.today().strftime('%Y_%m_%d')}.csv"
+    context.resources.s3.put_data(
+        key_name=s3_key,
+        data=aggregation,
+    )
 
 
 @graph
 def machine_learning_graph():
-    pass
+    stocks = get_s3_data()
+    update_aggregation_state(stocks)
+    aggregation = process_data(stocks)
+    put_redis_data(aggregation)
+    put_s3_data(aggregation)
+
+
+@graph
+def machine_learning_streaming_graph():
+    aggregation = get_and_process_data()
+    put_redis_data(aggregation)
+    put_s3_data(aggregation)
 
 
 local = {
@@ -63,27 +209,93 @@ docker = {
 }
 
 
-def docker_config():
-    pass
+@static_partitioned_config(partition_keys=[str(n) for n in range(1, 11)])
+def docker_config(partition_key: str):
+    return {
+        **docker,
+        "ops": {"get_s3_data": {"config": {"s3_key": f"prefix/stock_{partition_key}.csv"}}},
+    }
 
 
 machine_learning_job_local = machine_learning_graph.to_job(
     name="machine_learning_job_local",
+    config=local,
+    resource_defs={
+        "s3": mock_s3_resource,
+        "redis": ResourceDefinition.mock_resource(),
+    },
 )
 
 machine_learning_job_docker = machine_learning_graph.to_job(
     name="machine_learning_job_docker",
+    config=docker_config,
+    resource_defs={
+        "s3": s3_resource,
+        "redis": redis_resource,
+    },
+    # The resources retry transient errors themselves, this is a last resort
+    op_retry_policy=RetryPolicy(max_retries=1, delay=1),
 )
 
+machine_learning_streaming_job_local = machine_learning_streaming_graph.to_job(
+    name="machine_learning_streaming_job_local",
+    config={"ops": {"get_and_process_data": local["ops"]["get_s3_data"]}},
+    resource_defs={
+        "s3": mock_s3_resource,
+        "redis": ResourceDefinition.mock_resource(),
+    },
+)
 
-machine_learning_schedule_local = None
+machine_learning_streaming_job_docker = machine_learning_streaming_graph.to_job(
+    name="machine_learning_streaming_job_docker",
+    config={**docker, "ops": {"get_and_process_data": docker["ops"]["get_s3_data"]}},
+    resource_defs={
+        "s3": s3_resource,
+        "redis": redis_resource,
+    },
+    op_retry_policy=RetryPolicy(max_retries=1, delay=1),
+)
 
 
-@schedule
+machine_learning_schedule_local = ScheduleDefinition(job=machine_learning_job_local, cron_schedule="*/15 * * * *")
+
+
+@schedule(job=machine_learning_job_docker, cron_schedule="0 * * * *")
 def machine_learning_schedule_docker():
-    pass
+    for partition_key in docker_config.get_partition_keys():
+        yield RunRequest(
+            run_key=partition_key, run_config=docker_config.get_run_config_for_partition_key(partition_key)
+        )
+
 
+@sensor(job=machine_learning_job_docker, minimum_interval_seconds=30)
+def machine_learning_sensor_docker(context: SensorEvaluationContext):
+    new_objects = get_new_s3_objects(
+        bucket=S3["bucket"],
+        cursor=context.cursor,
+        prefix="prefix",
+        listing=SENSOR_LISTING,
+        endpoint_url=S3["endpoint_url"],
+        access_key=S3["access_key"],
+        secret_key=S3["secret_key"],
+    )
+    if not new_objects:
+        yield SkipReason("No new s3 files found in bucket.")
+        return
 
-@sensor
-def machine_learning_sensor_docker():
-    pass
+    # Group the new files so a bulk upload does not turn into one run per file. Batches
+    # are cut from the files after the cursor, which then moves past the last one, so
+    # each file lands in a single batch and its run key does not change between ticks
+    for keys in batch_keys(new_objects, SENSOR_MAX_KEYS_PER_RUN, SENSOR_MAX_BYTES_PER_RUN):
+        if len(keys) == 1:
+            run_key, op_config = keys[0], {"s3_key": keys[0]}
+        else:
+            run_key, op_config = f"{keys[0]}..{keys[-1]}", {"s3_keys": keys}
+        yield RunRequest(
+            run_key=run_key,
+            run_config={
+                "resources": docker["resources"],
+                "ops": {"get_s3_data": {"config": op_config}},
+            },
+        )
+    context.update_cursor(object_cursor(new_objects[-1]))
@@ -5,12 +5,13 @@ import pytest
 from dagster import AssetKey, build_op_context
 from workspaces.config import REDIS, S3
 from workspaces.project.week_4 import (
+    aggregation_state,
     get_s3_data,
     process_data,
     put_redis_data,
     put_s3_data,
 )
-from workspaces.types import Aggregation, Stock
+from workspaces.types import Aggregation, AggregationState, Stock, StockBatch
 
 
 @pytest.fixture
@@ -53,10 +54,31 @@ def test_stock_class_method(stock_list):
     assert isinstance(stock, Stock)
 
 
+def test_stock_parse_rows(stock_list):
+    stocks = Stock.parse_rows([stock_list, [], stock_list], validate=False)
+    assert stocks == [Stock.from_list(stock_list)] * 2
+    assert Stock.parse_rows([stock_list]) == stocks[:1]
+
+
 def test_aggregation(aggregation):
     assert isinstance(aggregation, Aggregation)
 
 
+def test_stock_batch(stocks, stock_list):
+    batch = StockBatch.from_stocks(stocks)
+    assert len(batch) == 4
+    assert batch[2] == stocks[2]
+    assert list(batch) == stocks
+    assert len(batch[1:3]) == 2
+
+    batch = StockBatch.from_rows([stock_list, [], stock_list])
+    assert len(batch) == 2
+    assert batch[0] == Stock.from_list(stock_list)
+
+    unpadded = ["2020/9/1", *stock_list[1:]]
+    assert StockBatch.from_rows([unpadded])[0] == Stock.from_list(unpadded) == Stock.from_list(stock_list)
+
+
 def test_get_s3_data(stock_list):
     s3_mock = MagicMock()
     s3_mock.get_data.return_value = [stock_list] * 10
@@ -70,6 +92,13 @@ def test_process_data(stocks):
         assert process_data(context, stocks) == Aggregation(date=datetime.datetime(2022, 1, 3, 0, 0), high=12.0)
 
 
+def test_process_data_stock_batch(stocks):
+    with build_op_context() as context:
+        assert process_data(context, StockBatch.from_stocks(stocks)) == Aggregation(
+            date=datetime.datetime(2022, 1, 3, 0, 0), high=12.0
+        )
+
+
 def test_put_redis_data(aggregation):
     redis_mock = MagicMock()
     with build_op_context(resources={"redis": redis_mock}) as context:
@@ -102,3 +131,26 @@ def test_put_redis_data_asset():
 def test_put_s3_data_asset():
     assert put_s3_data.required_resource_keys == {"s3", "io_manager"}
     assert put_s3_data.group_names_by_key == {AssetKey(["put_s3_data"]): "default"}
+
+
+def test_aggregation_state(stocks):
+    redis_mock = MagicMock()
+    redis_mock.merge_state.return_value = AggregationState(version=1)
+    with build_op_context(resources={"redis": redis_mock}, op_config={"source": "prefix/stock.csv"}) as context:
+        aggregation_state(context, StockBatch.from_stocks(stocks))
+    delta, source = redis_mock.merge_state.call_args.args
+    assert delta.count == 4
+    assert source == "prefix/stock.csv"
+
+
+def test_aggregation_state_file_source(stocks):
+    redis_mock = MagicMock()
+    redis_mock.merge_state.return_value = AggregationState(version=1)
+    with build_op_context(resources={"redis": redis_mock}, op_config={}) as context:
+        aggregation_state(context, StockBatch.from_stocks(stocks).with_source("prefix/stock.csv@abc"))
+    assert redis_mock.merge_state.call_args.args[1] == "prefix/stock.csv@abc"
+
+
+def test_aggregation_state_asset():
+    assert aggregation_state.required_resource_keys == {"redis", "io_manager"}
+    assert aggregation_state.group_names_by_key == {AssetKey(["aggregation_state"]): "default"}
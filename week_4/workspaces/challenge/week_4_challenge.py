@@ -25,14 +25,12 @@ def create_dbt_table(context):
     key_prefix=["postgresql"],
 )
 def dbt_table(context: OpExecutionContext, create_dbt_table):
-    sql = f"INSERT INTO {SOURCE_TABLE} (column_1, column_2, column_3) VALUES ('A', 'B', 'C');"
-
     number_of_rows = randint(1, 10)
-    for _ in range(number_of_rows):
-        context.resources.database.execute_query(sql)
-        context.log.info("Inserted a row")
+    context.resources.database.bulk_insert(
+        SOURCE_TABLE, ("column_1", "column_2", "column_3"), [("A", "B", "C")] * number_of_rows
+    )
 
-    context.log.info("Batch inserted")
+    context.log.info(f"Batch inserted {number_of_rows} rows")
 
 
 @asset
@@ -26,14 +26,10 @@ def create_table(context) -> String:
     op_tags={"kind": "postgres"},
 )
 def insert_into_table(context, create_table):
-    sql = f"INSERT INTO {create_table} (column_1) VALUES (1);"
-
     number_of_rows = randint(1, 10)
-    for _ in range(number_of_rows):
-        context.resources.database.execute_query(sql)
-        context.log.info("Inserted a row")
+    context.resources.database.bulk_insert(create_table, ("column_1",), [("1",)] * number_of_rows)
 
-    context.log.info("Batch inserted")
+    context.log.info(f"Batch inserted {number_of_rows} rows")
 
 
 etl_assets = load_assets_from_current_module(
@@ -2,7 +2,9 @@ from datetime import datetime
 from typing import List
 
 from dagster import (
+    AssetIn,
     AssetSelection,
+    Field,
     Nothing,
     OpExecutionContext,
     ScheduleDefinition,
@@ -11,27 +13,99 @@ from dagster import (
     define_asset_job,
     load_assets_from_current_module,
 )
-from workspaces.types import Aggregation, Stock
+from workspaces.config import S3_FILE
+from workspaces.resources import object_source
+from workspaces.types import (
+    Aggregation,
+    AggregationState,
+    Stock,
+    StockBatch,
+    StockRecords,
+)
 
 
-@asset
-def get_s3_data():
-    pass
+@asset(
+    config_schema={"s3_key": String},
+    required_resource_keys={"s3"},
+    op_tags={"kind": "s3"},
+    description="Get a batch of stocks from an S3 file",
+)
+def get_s3_data(context: OpExecutionContext) -> StockBatch:
+    # The rows are tagged with the file's key and ETag, so aggregation_state merges each version of it once
+    key, etags = context.op_config["s3_key"], {}
+    batch = StockBatch.from_rows(context.resources.s3.get_data(key_name=key, etags=etags))
+    return batch.with_source(object_source(key, etags.get(key)))
 
 
-@asset
-def process_data():
-    pass
+@asset(
+    ins={"get_s3_data": AssetIn(dagster_type=StockRecords)},
+    description="Given a list of stocks return the Aggregation with the greatest high",
+)
+def process_data(context: OpExecutionContext, get_s3_data) -> Aggregation:
+    if isinstance(get_s3_data, StockBatch):
+        return get_s3_data.max_high()
+    highest = max(get_s3_data, key=lambda stock: stock.high)
+    return Aggregation(date=highest.date, high=highest.high)
 
 
-@asset
-def put_redis_data():
-    pass
+@asset(
+    required_resource_keys={"redis"},
+    op_tags={"kind": "redis"},
+    description="Upload an Aggregation to Redis",
+)
+def put_redis_data(context: OpExecutionContext, process_data: Aggregation) -> Nothing:
+    redis = context.resources.redis
+    if redis.storage_mode == "timeseries":
+        retries = redis.put_series([process_data])
+    else:
+        retries = redis.put_data(
+            name=str(process_data.date),
+            value=str(process_data.high),
+        )
+    context.add_output_metadata({"redis_retries": int(retries)})
 
 
-@asset
-def put_s3_data():
-    pass
+@asset(
+    config_schema={
+        "source": Field(
+            String,
+            is_required=False,
+            description=(
+                "Name of the data merged, defaults to each file's key and ETag, "
+                "then for stocks from no known file the run key, the partition or the run id"
+            ),
+        )
+    },
+    ins={"get_s3_data": AssetIn(dagster_type=StockRecords)},
+    required_resource_keys={"redis"},
+    op_tags={"kind": "redis"},
+    description="Merge the stocks into the aggregation state kept in Redis",
+)
+def aggregation_state(context: OpExecutionContext, get_s3_data) -> Nothing:
+    batch = get_s3_data if isinstance(get_s3_data, StockBatch) else StockBatch.from_stocks(get_s3_data)
+    if "source" in context.op_config:
+        parts = [(context.op_config["source"], batch)]
+    else:
+        fallback = context.get_tag("dagster/run_key") or context.get_tag("dagster/partition") or context.run_id
+        parts = list(batch.split_sources()) or [(fallback, batch)]
+
+    for source, rows in parts:
+        state = context.resources.redis.merge_state(AggregationState.from_batch(rows), source)
+        context.log.info(f"Merged {source} into aggregation state version {state.version}")
+    context.add_output_metadata({"state_version": int(state.version), "state_count": int(state.count)})
+
+
+@asset(
+    required_resource_keys={"s3"},
+    op_tags={"kind": "s3"},
+    description="Upload an Aggregation to S3 file",
+)
+def put_s3_data(context: OpExecutionContext, process_data: Aggregation) -> Nothing:
+    s3_key = f"/aggregations/{datetime.today().strftime('%Y_%m_%d')}.csv"
+    context.resources.s3.put_data(
+        key_name=s3_key,
+        data=process_data,
+    )
 
 
 project_assets = load_assets_from_current_module()
@@ -39,6 +113,7 @@ project_assets = load_assets_from_current_module()
 
 machine_learning_asset_job = define_asset_job(
     name="machine_learning_asset_job",
+    config={"ops": {"get_s3_data": {"config": {"s3_key": S3_FILE}}}},
 )
 
 machine_learning_schedule = ScheduleDefinition(job=machine_learning_asset_job, cron_schedule="*/15 * * * *")
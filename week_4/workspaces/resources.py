@@ -1,23 +1,134 @@
+import calendar
+import codecs
 import csv
+import gzip
+import hashlib
+import io
 import json
-from random import randint
-from typing import Iterator
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from itertools import count, islice
+from random import randint, uniform
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
 from unittest.mock import MagicMock
 
 import boto3
 import redis
 import sqlalchemy
-from dagster import Field, InitResourceContext, Int, String, resource
-from workspaces.types import Aggregation
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from dagster import Bool, Field, Float, InitResourceContext, Int, String, resource
+from workspaces.types import Aggregation, AggregationState
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+
+class _CSVStream(io.TextIOBase):
+    """Read-only file over rows rendered as CSV, produced lazily as COPY reads it"""
+
+    def __init__(self, rows: Iterable[Sequence], chunk_size: int):
+        self._rows = iter(rows)
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self.rows = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            chunk = list(islice(self._rows, self._chunk_size))
+            if not chunk:
+                break
+            out = io.StringIO()
+            csv.writer(out).writerows(chunk)
+            self._buffer += out.getvalue()
+            self.rows += len(chunk)
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+_postgres_engines: Dict[tuple, sqlalchemy.engine.Engine] = {}
+_postgres_engines_lock = threading.Lock()
+
+
+def get_postgres_engine(
+    uri: str,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_pre_ping: bool = True,
+    pool_recycle: int = 3600,
+) -> sqlalchemy.engine.Engine:
+    """Return the engine shared by every Postgres resource in this process with the same settings.
+
+    Its connection pool outlives individual steps, so short queries reuse warm
+    connections instead of paying TCP and auth setup each time.
+    """
+    settings = dict(
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=pool_pre_ping,
+        pool_recycle=pool_recycle,
+    )
+    key = (os.getpid(), uri, *settings.values())
+    with _postgres_engines_lock:
+        if key not in _postgres_engines:
+            _postgres_engines[key] = sqlalchemy.create_engine(uri, **settings)
+        return _postgres_engines[key]
+
+
+POSTGRES_WRITE_MODES = ("append", "upsert")
 
 
 class Postgres:
-    def __init__(self, host: str, user: str, password: str, database: str):
+    watermark_table = "etl_watermarks"
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        password: str,
+        database: str,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_pre_ping: bool = True,
+        pool_recycle: int = 3600,
+    ):
         self.host = host
         self.user = user
         self.password = password
         self.database = database
-        self._engine = sqlalchemy.create_engine(self.uri)
+        self._engine = get_postgres_engine(
+            self.uri,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=pool_pre_ping,
+            pool_recycle=pool_recycle,
+        )
 
     @property
     def uri(self):
@@ -26,47 +137,754 @@ class Postgres:
     def execute_query(self, query: str):
         return self._engine.execute(query)
 
+    def stream_query(self, query: str, chunk_size: int = 10000) -> Iterator[List[tuple]]:
+        """Yield the rows of a query chunk_size at a time from a server-side cursor
+
+        Only one chunk is held in memory, whatever the size of the result.
+        """
+        with self._engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(sqlalchemy.text(query))
+            try:
+                for rows in iter(lambda: result.fetchmany(chunk_size), []):
+                    yield [tuple(row) for row in rows]
+            finally:
+                result.close()
+
+    def bulk_insert(self, table_name: str, columns: Sequence[str], rows: Iterable[Sequence], chunk_size: int = 10000):
+        """Load rows into a table in one statement, returning how many were written
+
+        On psycopg2 the rows are streamed as CSV through COPY FROM STDIN, so
+        None and empty strings both load as NULL. Other drivers fall back to a
+        parameterised executemany per chunk_size rows in a single transaction.
+        """
+        column_list = ", ".join(columns)
+        rows = iter(rows)
+        if self._engine.dialect.driver == "psycopg2":
+            stream = _CSVStream(rows, chunk_size)
+            connection = self._engine.raw_connection()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.copy_expert(f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT csv)", stream)
+                connection.commit()
+            finally:
+                connection.close()
+            return stream.rows
+
+        placeholders = ", ".join(f":c{index}" for index in range(len(columns)))
+        query = sqlalchemy.text(f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders})")
+        written = 0
+        with self._engine.begin() as connection:
+            for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+                connection.execute(query, [{f"c{index}": value for index, value in enumerate(row)} for row in chunk])
+                written += len(chunk)
+        return written
+
+    def upsert(
+        self,
+        table_name: str,
+        columns: Sequence[str],
+        rows: Iterable[Sequence],
+        key: Sequence[str],
+        chunk_size: int = 10000,
+        watermark_column: Optional[str] = None,
+        partition_key: str = "",
+    ) -> int:
+        """Merge rows into a table on its key with INSERT ... ON CONFLICT, returning how many were written
+
+        Re-running a load updates the rows it wrote before instead of appending
+        duplicates. key must be covered by a unique constraint on the table. On
+        psycopg2 the rows are COPYed into a temporary staging table holding only
+        the listed columns first. When a key repeats within one load, its last
+        row wins, as it does with one INSERT per row.
+
+        With a watermark_column, rows at or below the high-water mark stored for
+        (table_name, partition_key) are skipped and the mark is advanced in the
+        same transaction, so a retry only writes the delta. Marks are compared as
+        strings, so the column should hold ISO dates or timestamps.
+        """
+        column_list = ", ".join(columns)
+        key_list = ", ".join(key)
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in key)
+        on_conflict = f"ON CONFLICT ({key_list}) " + (f"DO UPDATE SET {updates}" if updates else "DO NOTHING")
+        rows = iter(rows)
+        with self._engine.begin() as connection:
+            if watermark_column:
+                watermark = [self._read_watermark(connection, table_name, partition_key)]
+                rows = _after_watermark(rows, list(columns).index(watermark_column), watermark)
+
+            if self._engine.dialect.driver == "psycopg2":
+                staging = f"{table_name.replace('.', '_')}_staging"
+                connection.execute(
+                    f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS "
+                    f"SELECT {column_list} FROM {table_name} WITH NO DATA"
+                )
+                # Numbers the rows in the order they are copied
+                connection.execute(f"ALTER TABLE {staging} ADD COLUMN staging_row BIGSERIAL")
+                stream = _CSVStream(rows, chunk_size)
+                with connection.connection.cursor() as cursor:
+                    cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", stream)
+                connection.execute(
+                    f"INSERT INTO {table_name} ({column_list}) "
+                    f"SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging} "
+                    f"ORDER BY {key_list}, staging_row DESC {on_conflict}"
+                )
+                written = stream.rows
+            else:
+                placeholders = ", ".join(f":c{index}" for index in range(len(columns)))
+                query = sqlalchemy.text(
+                    f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders}) {on_conflict}"
+                )
+                written = 0
+                for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+                    connection.execute(
+                        query, [{f"c{index}": value for index, value in enumerate(row)} for row in chunk]
+                    )
+                    written += len(chunk)
+
+            if watermark_column and watermark[0] is not None:
+                connection.execute(
+                    sqlalchemy.text(
+                        f"INSERT INTO {self.watermark_table} (table_name, partition_key, watermark) "
+                        "VALUES (:table_name, :partition_key, :watermark) "
+                        "ON CONFLICT (table_name, partition_key) DO UPDATE SET watermark = EXCLUDED.watermark"
+                    ),
+                    {"table_name": table_name, "partition_key": partition_key, "watermark": watermark[0]},
+                )
+        return written
+
+    def get_watermark(self, table_name: str, partition_key: str = "") -> Optional[str]:
+        """High-water mark of the last upsert into a table partition, None before the first one"""
+        with self._engine.begin() as connection:
+            return self._read_watermark(connection, table_name, partition_key)
+
+    def _read_watermark(self, connection, table_name: str, partition_key: str) -> Optional[str]:
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.watermark_table} "
+            "(table_name VARCHAR(255), partition_key VARCHAR(255), watermark VARCHAR(255), "
+            "PRIMARY KEY (table_name, partition_key))"
+        )
+        return connection.execute(
+            sqlalchemy.text(
+                f"SELECT watermark FROM {self.watermark_table} "
+                "WHERE table_name = :table_name AND partition_key = :partition_key"
+            ),
+            {"table_name": table_name, "partition_key": partition_key},
+        ).scalar()
+
+
+def _after_watermark(rows: Iterable[Sequence], position: int, watermark: List[Optional[str]]) -> Iterator[Sequence]:
+    """Yield the rows whose value at position is past watermark[0], advancing it as they go by"""
+    start = watermark[0]
+    for row in rows:
+        value = str(row[position])
+        if start is None or value > start:
+            if watermark[0] is None or value > watermark[0]:
+                watermark[0] = value
+            yield row
+
+
+def _iter_lines(chunks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[str]:
+    """Decode byte chunks incrementally and yield complete lines.
+
+    A line split across two chunks is carried over until its newline arrives, so
+    only one chunk and one partial line are held in memory at a time.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    for chunk in chunks:
+        buffer = pending + decoder.decode(chunk)
+        end = buffer.rfind("\n") + 1
+        if end:
+            yield from io.StringIO(buffer[:end])
+        pending = buffer[end:]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+_s3_clients: Dict[tuple, object] = {}
+_s3_clients_lock = threading.Lock()
+
+
+def get_s3_client(
+    access_key: str,
+    secret_key: str,
+    endpoint_url: str = None,
+    max_pool_connections: int = 10,
+    retry_mode: str = "standard",
+):
+    """Return a boto3 S3 client shared by everything in this process with the same settings.
+
+    Clients are thread safe and keep a warm connection pool, so they are only
+    built once per (endpoint, credentials, pool settings) and per process.
+    """
+    key = (os.getpid(), endpoint_url, access_key, secret_key, max_pool_connections, retry_mode)
+    with _s3_clients_lock:
+        if key not in _s3_clients:
+            session = boto3.session.Session()
+            _s3_clients[key] = session.client(
+                service_name="s3",
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                endpoint_url=endpoint_url,
+                config=Config(max_pool_connections=max_pool_connections, retries={"mode": retry_mode}),
+            )
+        return _s3_clients[key]
+
+
+CODECS = ("none", "gzip", "zstd")
+CODEC_SUFFIXES = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+
+def _iter_file(file: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+    with file:
+        yield from iter(lambda: file.read(chunk_size), b"")
+
+
+def _detect_codec(key_name: str, content_encoding: Optional[str] = None) -> str:
+    """Codec of an object from its ContentEncoding header, falling back to the key suffix"""
+    if content_encoding in CODECS:
+        return content_encoding
+    return next((codec for suffix, codec in CODEC_SUFFIXES.items() if key_name.endswith(suffix)), "none")
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstd compression requires the zstandard package")
+
+
+def _decompressor(codec: str):
+    if codec == "gzip":
+        return zlib.decompressobj(zlib.MAX_WBITS | 16)
+    _require_zstandard()
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def _decompress(chunks: Iterable[bytes], codec: str) -> Iterator[bytes]:
+    """Decompress a stream of byte chunks as they arrive
+
+    Concatenated gzip members and zstd frames are valid, so a new decompressor
+    starts where the last one ended. A stream that stops before the end of its
+    last member or frame raises EOFError instead of yielding partial records.
+    """
+    if codec not in ("gzip", "zstd"):
+        yield from chunks
+        return
+    decompressor = None
+    for chunk in chunks:
+        while chunk:
+            if decompressor is None or decompressor.eof:
+                decompressor = _decompressor(codec)
+            yield decompressor.decompress(chunk)
+            chunk = decompressor.unused_data
+    if decompressor is None:
+        # An empty object
+        return
+    if not decompressor.eof:
+        raise EOFError(f"{codec} stream ended before the end-of-stream marker was reached")
+    yield decompressor.flush()
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(data)
+    if codec == "zstd":
+        _require_zstandard()
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+class CachedObject(NamedTuple):
+    etag: str
+    content_encoding: Optional[str]
+    file: BinaryIO
+
+
+class S3DiskCache:
+    """Read-through cache of raw S3 object bytes on local disk.
+
+    Each object has a small index file holding its ETag, and its bytes live in
+    a data file named after that ETag. Both are written to a temporary file and
+    renamed into place, so run workers sharing the directory never see a partial
+    or mismatched entry. Data files are evicted least recently used first once
+    the directory grows past max_bytes, together with the index pointing at
+    them. Temporary files older than tmp_max_age seconds were left behind by a
+    worker that died mid-write and are removed on the same sweep.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, tmp_max_age: float = 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.tmp_max_age = tmp_max_age
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _etag_hash(etag: str) -> str:
+        return hashlib.sha256(etag.encode()).hexdigest()[:16]
+
+    def _path(self, bucket: str, key_name: str, etag: str = None) -> str:
+        name = hashlib.sha256(f"{bucket}/{key_name}".encode()).hexdigest()
+        if etag is None:
+            return os.path.join(self.directory, f"{name}.json")
+        return os.path.join(self.directory, f"{name}.{self._etag_hash(etag)}.data")
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # Another worker removed it first
+            pass
+
+    def _replace(self, write, path: str):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                write(file)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def lookup(self, bucket: str, key_name: str) -> Optional[CachedObject]:
+        """Open the cached copy of an object, if any"""
+        try:
+            with open(self._path(bucket, key_name)) as file:
+                index = json.load(file)
+            data = open(self._path(bucket, key_name, index["etag"]), "rb")
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(data.fileno())
+        return CachedObject(etag=index["etag"], content_encoding=index.get("content_encoding"), file=data)
+
+    def store(
+        self, bucket: str, key_name: str, etag: str, content_encoding: Optional[str], chunks: Iterable[bytes]
+    ) -> Iterator[bytes]:
+        """Pass chunks through while writing them to the cache, committing the entry once all have been read"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, self._path(bucket, key_name, etag))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        index = json.dumps({"etag": etag, "content_encoding": content_encoding}).encode()
+        self._replace(lambda file: file.write(index), self._path(bucket, key_name))
+        self.evict()
+
+    def _evict_entry(self, data_path: str):
+        """Remove a data file and its index, unless the index already points at newer data"""
+        self._unlink(data_path)
+        name, etag_hash, _ = os.path.basename(data_path).split(".")
+        index_path = os.path.join(self.directory, f"{name}.json")
+        try:
+            with open(index_path) as file:
+                etag = json.load(file)["etag"]
+        except (OSError, ValueError, KeyError):
+            return
+        if self._etag_hash(etag) == etag_hash:
+            self._unlink(index_path)
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith(".tmp") and now - stat.st_mtime > self.tmp_max_age:
+                self._unlink(entry.path)
+            elif entry.name.endswith(".data"):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._evict_entry(path)
+            total -= size
+
 
 class S3:
-    def __init__(self, bucket: str, access_key: str, secret_key: str, endpoint_url: str = None):
+    def __init__(
+        self,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        endpoint_url: str = None,
+        chunk_size: int = 1024 * 1024,
+        part_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 1,
+        max_pool_connections: int = 10,
+        retry_mode: str = "standard",
+        compression: str = "none",
+        cache_dir: str = None,
+        cache_max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        if compression not in CODECS:
+            raise ValueError(f"Unknown compression {compression}, expected one of {CODECS}")
+        if compression == "zstd":
+            _require_zstandard()
         self.bucket = bucket
         self.access_key = access_key
         self.secret_key = secret_key
         self.endpoint_url = endpoint_url
+        self.chunk_size = chunk_size
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.max_pool_connections = max_pool_connections
+        self.retry_mode = retry_mode
+        self.compression = compression
+        self.cache = S3DiskCache(cache_dir, cache_max_bytes) if cache_dir else None
         self.client = self._client()
 
     def _client(self):
-        session = boto3.session.Session()
-        return session.client(
-            service_name="s3",
-            aws_access_key_id=self.access_key,
-            aws_secret_access_key=self.secret_key,
+        return get_s3_client(
+            access_key=self.access_key,
+            secret_key=self.secret_key,
             endpoint_url=self.endpoint_url,
+            max_pool_connections=self.max_pool_connections,
+            retry_mode=self.retry_mode,
+        )
+
+    def _get_range(self, key_name: str, start: int, etag: Optional[str] = None) -> dict:
+        extra = {"IfMatch": etag} if etag else {}
+        return self.client.get_object(
+            Bucket=self.bucket,
+            Key=key_name,
+            Range=f"bytes={start}-{start + self.part_size - 1}",
+            **extra,
         )
 
-    def get_data(self, key_name: str) -> Iterator:
+    def _read_range(self, key_name: str, start: int, etag: Optional[str]) -> bytes:
+        try:
+            return self._get_range(key_name, start, etag)["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("412", "PreconditionFailed"):
+                raise RuntimeError(f"s3://{self.bucket}/{key_name} was overwritten during a ranged download") from e
+            raise
+
+    def _download_parts(self, key_name: str) -> Tuple[Optional[str], Optional[str], Iterator[bytes]]:
+        """Download an object as concurrent ranged GETs.
+
+        The first part tells us the object size, encoding and ETag. Later parts
+        are only served for that ETag, so an object overwritten mid-download
+        fails instead of mixing two versions. At most max_concurrency parts are
+        in flight or waiting to be consumed at a time.
+        """
+        try:
+            first = self._get_range(key_name, 0)
+        except ClientError as e:
+            # Ranged GETs on an empty object are rejected
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                return None, None, iter(())
+            raise
+        return first.get("ContentEncoding"), first.get("ETag"), self._iter_parts(key_name, first)
+
+    def _iter_parts(self, key_name: str, first: dict) -> Iterator[bytes]:
+        if "ContentRange" not in first:
+            # The endpoint ignored the Range header and sent the whole object
+            yield from first["Body"].iter_chunks(chunk_size=self.chunk_size)
+            return
+        size = int(first["ContentRange"].rsplit("/", 1)[1])
+        etag = first.get("ETag")
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            starts = iter(range(self.part_size, size, self.part_size))
+            pending = deque(
+                executor.submit(self._read_range, key_name, start, etag)
+                for start in islice(starts, self.max_concurrency)
+            )
+            yield first["Body"].read()
+            while pending:
+                part = pending.popleft().result()
+                pending.extend(executor.submit(self._read_range, key_name, start, etag) for start in islice(starts, 1))
+                yield part
+
+    def _download_cached(self, key_name: str) -> Tuple[Optional[str], Optional[str], Iterator[bytes]]:
+        """Serve an object from the disk cache when S3 confirms the cached ETag is current"""
+        cached = self.cache.lookup(self.bucket, key_name)
+        if cached is None:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key_name)
+        else:
+            try:
+                obj = self.client.get_object(Bucket=self.bucket, Key=key_name, IfNoneMatch=cached.etag)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                    return cached.content_encoding, cached.etag, _iter_file(cached.file, self.chunk_size)
+                cached.file.close()
+                raise
+            cached.file.close()
+
+        content_encoding = obj.get("ContentEncoding")
+        chunks = obj["Body"].iter_chunks(chunk_size=self.chunk_size)
+        return (
+            content_encoding,
+            obj["ETag"],
+            self.cache.store(self.bucket, key_name, obj["ETag"], content_encoding, chunks),
+        )
+
+    def _download(self, key_name: str) -> Tuple[Optional[str], Optional[str], Iterator[bytes]]:
+        """Start downloading an object, returning its ContentEncoding, ETag and an iterator over its raw bytes"""
+        if self.cache is not None:
+            return self._download_cached(key_name)
+        if self.max_concurrency > 1:
+            return self._download_parts(key_name)
         obj = self.client.get_object(Bucket=self.bucket, Key=key_name)
-        data = obj["Body"].read().decode("utf-8").split("\n")
-        for record in csv.reader(data):
+        return obj.get("ContentEncoding"), obj.get("ETag"), obj["Body"].iter_chunks(chunk_size=self.chunk_size)
+
+    def get_data(self, key_name: str, etags: Dict[str, str] = None) -> Iterator:
+        """Read the csv records of an object
+
+        When etags is given, the ETag of the version being read is stored in it
+        under key_name once the download starts.
+        """
+        content_encoding, etag, chunks = self._download(key_name)
+        if etags is not None and etag is not None:
+            etags[key_name] = etag
+        chunks = _decompress(chunks, _detect_codec(key_name, content_encoding))
+        for record in csv.reader(_iter_lines(chunks)):
             yield record
 
+    def get_many(
+        self, keys: Iterable[str], max_workers: int = None, etags: Dict[str, str] = None
+    ) -> Iterator[Tuple[str, List[List[str]]]]:
+        """Fetch several objects concurrently over the shared client.
+
+        Yields (key, records) as each download finishes, not in the order of keys.
+        By default one download runs per pooled connection. etags is filled in
+        as in get_data.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_pool_connections) as executor:
+            futures = {executor.submit(lambda key: list(self.get_data(key, etags)), key): key for key in keys}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
     def put_data(self, key_name: str, data: Aggregation):
+        body = json.dumps(data.dict(), default=str).encode("utf-8")
+        extra = {}
+        if self.compression != "none":
+            body = _compress(body, self.compression)
+            extra["ContentEncoding"] = self.compression
         self.client.put_object(
             Bucket=self.bucket,
             Key=key_name,
-            Body=json.dumps(data.dict(), default=str),
+            Body=body,
+            **extra,
         )
 
 
+def object_source(key_name: str, etag: Optional[str]) -> str:
+    """Name one version of an S3 object, so a rewritten object counts as a new source"""
+    if not etag:
+        return key_name
+    version = etag.strip('"')
+    return f"{key_name}@{version}"
+
+
+_redis_pools: Dict[tuple, redis.ConnectionPool] = {}
+_redis_pools_lock = threading.Lock()
+
+
+def get_redis_pool(
+    host: str,
+    port: int,
+    max_connections: int = 50,
+    socket_timeout: float = 5.0,
+    socket_connect_timeout: float = 5.0,
+    health_check_interval: int = 30,
+    socket_keepalive: bool = True,
+) -> redis.ConnectionPool:
+    """Return the connection pool shared by every Redis resource in this process with the same settings.
+
+    Steps running in the same worker then reuse warm connections, and idle ones
+    are health checked before use.
+    """
+    settings = dict(
+        host=host,
+        port=port,
+        max_connections=max_connections,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=socket_connect_timeout,
+        health_check_interval=health_check_interval,
+        socket_keepalive=socket_keepalive,
+    )
+    key = (os.getpid(), *settings.values())
+    with _redis_pools_lock:
+        if key not in _redis_pools:
+            _redis_pools[key] = redis.ConnectionPool(**settings)
+        return _redis_pools[key]
+
+
+REDIS_RETRYABLE_ERRORS = ["ConnectionError", "TimeoutError", "BusyLoadingError"]
+REDIS_STORAGE_MODES = ("string", "timeseries")
+
+
+def _epoch(date: datetime) -> int:
+    """Seconds since the epoch, reading naive datetimes as UTC"""
+    return calendar.timegm(date.utctimetuple())
+
+
 class Redis:
-    def __init__(self, host: str, port: int):
-        self.client = redis.Redis(host=host, port=port)
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        chunk_size: int = 1000,
+        transaction: bool = False,
+        max_connections: int = 50,
+        socket_timeout: float = 5.0,
+        socket_connect_timeout: float = 5.0,
+        health_check_interval: int = 30,
+        socket_keepalive: bool = True,
+        max_retries: int = 5,
+        retry_backoff: float = 0.05,
+        retry_backoff_max: float = 2.0,
+        retry_deadline: float = 10.0,
+        retry_on: Sequence[str] = REDIS_RETRYABLE_ERRORS,
+        storage_mode: str = "string",
+        series_key: str = "aggregations",
+        state_key: str = "aggregation_state",
+    ):
+        if storage_mode not in REDIS_STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode {storage_mode}, expected one of {REDIS_STORAGE_MODES}")
+        unknown = [name for name in retry_on if not hasattr(redis.exceptions, name)]
+        if unknown:
+            raise ValueError(f"Unknown redis exceptions in retry_on: {unknown}")
+        pool = get_redis_pool(
+            host=host,
+            port=port,
+            max_connections=max_connections,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=socket_connect_timeout,
+            health_check_interval=health_check_interval,
+            socket_keepalive=socket_keepalive,
+        )
+        self.client = redis.Redis(connection_pool=pool)
+        self.chunk_size = chunk_size
+        self.transaction = transaction
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.retry_deadline = retry_deadline
+        self.retry_on = tuple(getattr(redis.exceptions, name) for name in retry_on)
+        self.storage_mode = storage_mode
+        self.series_key = series_key
+        self.state_key = state_key
+
+    def _with_retry(self, fn: Callable[[], None], retry_on: Tuple[Type[Exception], ...] = ()) -> int:
+        """Call fn, retrying transient errors with exponential backoff and full jitter.
+
+        Errors in retry_on are retried on top of the configured ones. Gives up
+        after max_retries retries, or when the next wait would pass the deadline.
+        Returns how many retries were needed.
+        """
+        deadline = time.monotonic() + self.retry_deadline
+        for attempt in count():
+            try:
+                fn()
+                return attempt
+            except self.retry_on + retry_on:
+                delay = uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2**attempt))
+                if attempt >= self.max_retries or time.monotonic() + delay > deadline:
+                    raise
+                time.sleep(delay)
+
+    def put_data(self, name: str, value: str) -> int:
+        """Set a key, returning the number of retries it took"""
+
+        def set_value():
+            # Occasional error
+            # if randint(0, 1) == 0:
+            #     raise redis.exceptions.ConnectionError("Injected occasional error")
+            self.client.set(name, value)
+
+        return self._with_retry(set_value)
+
+    def put_many(self, mapping: Mapping[str, str]) -> int:
+        """Write many keys in one round trip, as one MSET per chunk queued on a single pipeline
+
+        Returns the number of retries it took.
+        """
+
+        def set_values():
+            items = iter(mapping.items())
+            with self.client.pipeline(transaction=self.transaction) as pipe:
+                for chunk in iter(lambda: dict(islice(items, self.chunk_size)), {}):
+                    pipe.mset(chunk)
+                pipe.execute()
+
+        return self._with_retry(set_values)
+
+    @property
+    def _series_fields_key(self) -> str:
+        return f"{self.series_key}:fields"
+
+    def put_series(self, aggregations: Sequence[Aggregation]) -> int:
+        """Add aggregations to the time series, returning the number of retries it took
+
+        Each date is a member of a sorted set scored by its epoch seconds, and the
+        aggregation's fields are kept as JSON in a hash under the same member.
+        """
+        members = {str(aggregation.date): _epoch(aggregation.date) for aggregation in aggregations}
+        fields = {str(aggregation.date): json.dumps(aggregation.dict(), default=str) for aggregation in aggregations}
+
+        def add_values():
+            with self.client.pipeline(transaction=self.transaction) as pipe:
+                pipe.zadd(self.series_key, members)
+                pipe.hset(self._series_fields_key, mapping=fields)
+                pipe.execute()
+
+        return self._with_retry(add_values)
+
+    def get_range(self, start: datetime, end: datetime) -> List[Aggregation]:
+        """Aggregations dated between start and end inclusive, oldest first"""
+        members = self.client.zrangebyscore(self.series_key, _epoch(start), _epoch(end))
+        if not members:
+            return []
+        values = self.client.hmget(self._series_fields_key, members)
+        return [Aggregation(**json.loads(value)) for value in values if value is not None]
+
+    def get_state(self) -> AggregationState:
+        """The stored aggregation state, empty if nothing has been merged yet"""
+        value = self.client.get(self.state_key)
+        return AggregationState.parse_raw(value) if value else AggregationState()
+
+    def merge_state(self, delta: AggregationState, source: str) -> AggregationState:
+        """Merge the state of one source into the stored one and return the result
+
+        The sources merged so far are kept in a Redis set next to the state, so
+        merging a source twice changes nothing and checking it costs the same
+        however many have been merged. The check and write run under WATCH/MULTI:
+        if another run stores a new version in between, the transaction is
+        aborted and retried with the usual backoff and deadline, so concurrent
+        runs never overwrite each other.
+        """
+        sources_key = f"{self.state_key}:sources"
+        merged = []
+
+        def merge():
+            with self.client.pipeline() as pipe:
+                pipe.watch(self.state_key, sources_key)
+                value = pipe.get(self.state_key)
+                state = AggregationState.parse_raw(value) if value else AggregationState()
+                if pipe.sismember(sources_key, source):
+                    pipe.unwatch()
+                    merged[:] = [state]
+                    return
+                result = state.merge(delta)
+                result.version = state.version + 1
+                pipe.multi()
+                pipe.set(self.state_key, result.json())
+                pipe.sadd(sources_key, source)
+                pipe.execute()
+                merged[:] = [result]
 
-    def put_data(self, name: str, value: str):
-        # Occasional error
-        # if randint(0, 1) == 0:
-        #     raise Exception("Injected occasional error")
-        self.client.set(name, value)
+        self._with_retry(merge, retry_on=(redis.WatchError,))
+        return merged[0]
 
 
 @resource(
@@ -75,6 +893,10 @@ class Redis:
         "user": Field(String),
         "password": Field(String),
         "database": Field(String),
+        "pool_size": Field(Int, default_value=5, description="Connections kept open in the per-process pool"),
+        "max_overflow": Field(Int, default_value=10, description="Extra connections allowed beyond pool_size"),
+        "pool_pre_ping": Field(Bool, default_value=True, description="Check a pooled connection is alive before use"),
+        "pool_recycle": Field(Int, default_value=3600, description="Seconds before a pooled connection is replaced"),
     },
     description="A resource that can run Postgres",
 )
@@ -85,6 +907,10 @@ def postgres_resource(context: InitResourceContext) -> Postgres:
         user=context.resource_config["user"],
         password=context.resource_config["password"],
         database=context.resource_config["database"],
+        pool_size=context.resource_config["pool_size"],
+        max_overflow=context.resource_config["max_overflow"],
+        pool_pre_ping=context.resource_config["pool_pre_ping"],
+        pool_recycle=context.resource_config["pool_recycle"],
     )
 
 
@@ -108,6 +934,46 @@ def mock_s3_resource(context: InitResourceContext) -> MagicMock:
         "access_key": Field(String),
         "secret_key": Field(String),
         "endpoint_url": Field(String),
+        "chunk_size": Field(
+            Int,
+            default_value=1024 * 1024,
+            description="Bytes read from the object body at a time when streaming records",
+        ),
+        "part_size": Field(
+            Int,
+            default_value=8 * 1024 * 1024,
+            description="Size of each ranged GET when downloading with more than one connection",
+        ),
+        "max_concurrency": Field(
+            Int,
+            default_value=1,
+            description="Number of concurrent ranged GETs per object, 1 streams the object over a single GET",
+        ),
+        "max_pool_connections": Field(
+            Int,
+            default_value=10,
+            description="Size of the connection pool of the shared boto3 client",
+        ),
+        "retry_mode": Field(
+            String,
+            default_value="standard",
+            description="botocore retry mode: legacy, standard or adaptive",
+        ),
+        "compression": Field(
+            String,
+            default_value="none",
+            description="Codec used to compress objects written by put_data: none, gzip or zstd",
+        ),
+        "cache_dir": Field(
+            String,
+            is_required=False,
+            description="Local directory for a read-through cache of downloaded objects, validated by ETag",
+        ),
+        "cache_max_bytes": Field(
+            Int,
+            default_value=1024 * 1024 * 1024,
+            description="Size above which least recently used objects are evicted from the cache",
+        ),
     },
     description="A resource that can run S3",
 )
@@ -118,6 +984,14 @@ def s3_resource(context: InitResourceContext) -> S3:
         access_key=context.resource_config["access_key"],
         secret_key=context.resource_config["secret_key"],
         endpoint_url=context.resource_config["endpoint_url"],
+        chunk_size=context.resource_config["chunk_size"],
+        part_size=context.resource_config["part_size"],
+        max_concurrency=context.resource_config["max_concurrency"],
+        max_pool_connections=context.resource_config["max_pool_connections"],
+        retry_mode=context.resource_config["retry_mode"],
+        compression=context.resource_config["compression"],
+        cache_dir=context.resource_config.get("cache_dir"),
+        cache_max_bytes=context.resource_config["cache_max_bytes"],
     )
 
 
@@ -125,6 +999,39 @@ def s3_resource(context: InitResourceContext) -> S3:
     config_schema={
         "host": Field(String),
         "port": Field(Int),
+        "chunk_size": Field(Int, default_value=1000, description="Keys per MSET when writing with put_many"),
+        "transaction": Field(
+            Bool,
+            default_value=False,
+            description="Wrap put_many in MULTI/EXEC so a batch is applied atomically",
+        ),
+        "max_connections": Field(Int, default_value=50, description="Size of the per-process connection pool"),
+        "socket_timeout": Field(Float, default_value=5.0, description="Seconds to wait on a command"),
+        "socket_connect_timeout": Field(Float, default_value=5.0, description="Seconds to wait for a connection"),
+        "health_check_interval": Field(
+            Int,
+            default_value=30,
+            description="Seconds a connection may sit idle before it is checked with a PING on reuse",
+        ),
+        "socket_keepalive": Field(Bool, default_value=True, description="Enable TCP keepalive on connections"),
+        "max_retries": Field(Int, default_value=5, description="Retries of a failed write before giving up"),
+        "retry_backoff": Field(Float, default_value=0.05, description="Base of the exponential backoff in seconds"),
+        "retry_backoff_max": Field(Float, default_value=2.0, description="Longest wait between two retries"),
+        "retry_deadline": Field(Float, default_value=10.0, description="Seconds after which a write stops retrying"),
+        "retry_on": Field(
+            [String],
+            default_value=REDIS_RETRYABLE_ERRORS,
+            description="Names of the redis.exceptions classes that are retried",
+        ),
+        "storage_mode": Field(
+            String,
+            default_value="string",
+            description="'string' keys per date, or 'timeseries' to keep aggregations in a sorted set by date",
+        ),
+        "series_key": Field(String, default_value="aggregations", description="Sorted set used in timeseries mode"),
+        "state_key": Field(
+            String, default_value="aggregation_state", description="Key holding the incremental aggregation state"
+        ),
     },
     description="A resource that can run Redis",
 )
@@ -133,4 +1040,19 @@ def redis_resource(context: InitResourceContext) -> Redis:
     return Redis(
         host=context.resource_config["host"],
         port=context.resource_config["port"],
+        chunk_size=context.resource_config["chunk_size"],
+        transaction=context.resource_config["transaction"],
+        max_connections=context.resource_config["max_connections"],
+        socket_timeout=context.resource_config["socket_timeout"],
+        socket_connect_timeout=context.resource_config["socket_connect_timeout"],
+        health_check_interval=context.resource_config["health_check_interval"],
+        socket_keepalive=context.resource_config["socket_keepalive"],
+        max_retries=context.resource_config["max_retries"],
+        retry_backoff=context.resource_config["retry_backoff"],
+        retry_backoff_max=context.resource_config["retry_backoff_max"],
+        retry_deadline=context.resource_config["retry_deadline"],
+        retry_on=context.resource_config["retry_on"],
+        storage_mode=context.resource_config["storage_mode"],
+        series_key=context.resource_config["series_key"],
+        state_key=context.resource_config["state_key"],
     )
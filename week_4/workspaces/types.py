@@ -1,6 +1,9 @@
 from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
-from dagster import usable_as_dagster_type
+import numpy as np
+from dagster import DagsterType, usable_as_dagster_type
 from pydantic import BaseModel
 
 
@@ -25,8 +28,257 @@ class Stock(BaseModel):
             low=float(input_list[5]),
         )
 
+    @classmethod
+    def parse_rows(cls, rows: Iterable[List[str]], validate: bool = True) -> List["Stock"]:
+        """Parse csv records in bulk
+
+        Dates go through a memoized fixed-format parser. With validate=False the
+        pydantic validation is skipped, which is only safe for trusted sources.
+        """
+        build = cls if validate else cls.construct
+        return [
+            build(
+                date=_parse_date(row[0]),
+                close=float(row[1]),
+                volume=int(float(row[2])),
+                open=float(row[3]),
+                high=float(row[4]),
+                low=float(row[5]),
+            )
+            for row in rows
+            if row
+        ]
+
+
+@lru_cache(maxsize=65536)
+def _parse_date(value: str) -> datetime:
+    """Parse a %Y/%m/%d date without going through strptime"""
+    if len(value) == 10 and value[4] == "/" and value[7] == "/":
+        return datetime(int(value[:4]), int(value[5:7]), int(value[8:]))
+    return datetime.strptime(value, "%Y/%m/%d")
+
+
+def _iso_date(value: str) -> str:
+    """A %Y/%m/%d date as the ISO string NumPy parses, padding the month and day when they are not"""
+    if len(value) == 10 and value[4] == "/" and value[7] == "/":
+        return value.replace("/", "-")
+    return _parse_date(value).strftime("%Y-%m-%d")
+
 
 @usable_as_dagster_type(description="Aggregation of stock data")
 class Aggregation(BaseModel):
     date: datetime
     high: float
+
+
+class DayExtrema(BaseModel):
+    high: float
+    low: float
+    count: int
+
+
+@usable_as_dagster_type(description="Aggregation state accumulated over every source merged into it")
+class AggregationState(BaseModel):
+    """Running aggregation of stock data: the max high, per-day extrema and counts.
+
+    States built from separate sources merge in any order to the same result,
+    so each new file only costs a pass over that file. Merging is not
+    idempotent: whoever stores the state records which sources it holds (see
+    Redis.merge_state). version counts the merges that have been stored.
+    """
+
+    version: int = 0
+    count: int = 0
+    max_high: Optional[Aggregation] = None
+    days: Dict[str, DayExtrema] = {}
+
+    @classmethod
+    def from_batch(cls, batch: "StockBatch") -> "AggregationState":
+        if not len(batch):
+            return cls()
+        days, index = np.unique(batch.date.astype("datetime64[D]"), return_inverse=True)
+        highs = np.full(len(days), -np.inf)
+        np.maximum.at(highs, index, batch.high)
+        lows = np.full(len(days), np.inf)
+        np.minimum.at(lows, index, batch.low)
+        counts = np.bincount(index, minlength=len(days))
+        return cls(
+            count=len(batch),
+            max_high=batch.max_high(),
+            days={
+                str(day): DayExtrema(high=float(high), low=float(low), count=int(count))
+                for day, high, low, count in zip(days, highs, lows, counts)
+            },
+        )
+
+    def merge(self, other: "AggregationState") -> "AggregationState":
+        """Combine two states, keeping this one's version"""
+        days = dict(self.days)
+        for day, extrema in other.days.items():
+            if day in days:
+                extrema = DayExtrema(
+                    high=max(days[day].high, extrema.high),
+                    low=min(days[day].low, extrema.low),
+                    count=days[day].count + extrema.count,
+                )
+            days[day] = extrema
+        candidates = [aggregation for aggregation in (self.max_high, other.max_high) if aggregation is not None]
+        return AggregationState(
+            version=self.version,
+            count=self.count + other.count,
+            max_high=max(candidates, key=lambda aggregation: (aggregation.high, -aggregation.date.timestamp()))
+            if candidates
+            else None,
+            days=days,
+        )
+
+
+@usable_as_dagster_type(description="Columnar batch of stock data")
+class StockBatch:
+    """Stock data held as one NumPy array per field.
+
+    Rows are only turned into Stock objects when they are accessed, so a batch
+    costs six arrays regardless of how many rows it holds and pickles as such
+    through the IO managers. When the files the rows came from are known,
+    sources holds one (source, number of rows) pair per file, in row order.
+    """
+
+    chunk_size = 65536
+
+    def __init__(
+        self,
+        date: Sequence,
+        close: Sequence,
+        volume: Sequence,
+        open: Sequence,
+        high: Sequence,
+        low: Sequence,
+        sources: Sequence[Tuple[str, int]] = (),
+    ):
+        self.date = np.asarray(date, dtype="datetime64[s]")
+        self.close = np.asarray(close, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.int64)
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        lengths = {len(column) for column in self.columns()}
+        if len(lengths) > 1:
+            raise ValueError(f"StockBatch columns must have the same length, got {sorted(lengths)}")
+        self.sources = list(sources)
+
+    @classmethod
+    def empty(cls) -> "StockBatch":
+        return cls(date=[], close=[], volume=[], open=[], high=[], low=[])
+
+    @classmethod
+    def from_stocks(cls, stocks: Sequence[Stock]) -> "StockBatch":
+        return cls(
+            date=[np.datetime64(stock.date, "s") for stock in stocks],
+            close=[stock.close for stock in stocks],
+            volume=[stock.volume for stock in stocks],
+            open=[stock.open for stock in stocks],
+            high=[stock.high for stock in stocks],
+            low=[stock.low for stock in stocks],
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[List[str]]) -> "StockBatch":
+        """Build a batch from csv records, converting them a chunk at a time"""
+        batches = list(cls.iter_chunks(rows))
+        return cls.concat(batches) if batches else cls.empty()
+
+    @classmethod
+    def iter_chunks(cls, rows: Iterable[List[str]]) -> Iterator["StockBatch"]:
+        """Yield csv records as batches of up to chunk_size rows, holding one chunk at a time"""
+        chunk = []
+        for row in rows:
+            if not row:
+                continue
+            chunk.append(row)
+            if len(chunk) == cls.chunk_size:
+                yield cls._from_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield cls._from_chunk(chunk)
+
+    @classmethod
+    def _from_chunk(cls, rows: List[List[str]]) -> "StockBatch":
+        if not rows:
+            return cls.empty()
+        date, close, volume, open, high, low = zip(*(row[:6] for row in rows))
+        return cls(
+            date=np.array([_iso_date(value) for value in date], dtype="datetime64[s]"),
+            close=np.array(close, dtype=np.float64),
+            volume=np.array(volume, dtype=np.float64).astype(np.int64),
+            open=np.array(open, dtype=np.float64),
+            high=np.array(high, dtype=np.float64),
+            low=np.array(low, dtype=np.float64),
+        )
+
+    @classmethod
+    def concat(cls, batches: Sequence["StockBatch"]) -> "StockBatch":
+        if len(batches) == 1:
+            return batches[0]
+        columns = (np.concatenate(columns) for columns in zip(*(batch.columns() for batch in batches)))
+        # Sources are only kept when every batch knows its own
+        if all(batch.sources for batch in batches):
+            return cls(*columns, sources=[source for batch in batches for source in batch.sources])
+        return cls(*columns)
+
+    def with_source(self, source: str) -> "StockBatch":
+        """The same rows, all attributed to source"""
+        return StockBatch(*self.columns(), sources=[(source, len(self))])
+
+    def split_sources(self) -> Iterator[Tuple[str, "StockBatch"]]:
+        """Yield the rows of each source in turn, nothing if the sources are unknown"""
+        start = 0
+        for source, number_of_rows in self.sources:
+            yield source, self[start : start + number_of_rows]
+            start += number_of_rows
+
+    def columns(self) -> tuple:
+        return (self.date, self.close, self.volume, self.open, self.high, self.low)
+
+    def row(self, index: int) -> Stock:
+        return Stock.construct(
+            date=self.date[index].item(),
+            close=float(self.close[index]),
+            volume=int(self.volume[index]),
+            open=float(self.open[index]),
+            high=float(self.high[index]),
+            low=float(self.low[index]),
+        )
+
+    def to_stocks(self) -> List[Stock]:
+        return list(self)
+
+    def max_high(self) -> Aggregation:
+        if not len(self):
+            raise ValueError("Cannot aggregate an empty StockBatch")
+        index = int(np.argmax(self.high))
+        return Aggregation(date=self.date[index].item(), high=float(self.high[index]))
+
+    def __len__(self) -> int:
+        return len(self.high)
+
+    def __iter__(self) -> Iterator[Stock]:
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Stock, "StockBatch"]:
+        if isinstance(index, slice):
+            return StockBatch(*(column[index] for column in self.columns()))
+        return self.row(index)
+
+
+def _is_stock_records(_, value) -> bool:
+    if isinstance(value, StockBatch):
+        return True
+    return isinstance(value, list) and all(isinstance(stock, Stock) for stock in value)
+
+
+StockRecords = DagsterType(
+    name="StockRecords",
+    type_check_fn=_is_stock_records,
+    description="Stock data as either a StockBatch or a list of Stock",
+)